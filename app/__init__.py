@@ -6,64 +6,150 @@ from logging.handlers import RotatingFileHandler
 from flask import Flask
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager
-from flask_migrate import Migrate
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 
+from app.database import SQLAlchemy
+from app.log_pipeline import DigestMailHandler
+from app.log_pipeline import start_pipeline
 from config import Config
 
 
-# flask instance
-app = Flask(__name__)
-app.config.from_object(Config)
-
 # login
-login = LoginManager(app)
-login.login_view = 'login'
+login = LoginManager()
+login.login_view = 'auth.login'
 
 # database
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+db = SQLAlchemy()
 
 # Bootstrap
-bootstrap = Bootstrap(app)
+bootstrap = Bootstrap()
 
 # Moment.js
-moment = Moment(app)
+moment = Moment()
+
+
+def create_app(config_class=Config) -> Flask:
+    """
+    builds a flask instance configured from config_class
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+
+    login.init_app(app)
+    db.init_app(app)
+    bootstrap.init_app(app)
+    moment.init_app(app)
+
+    # alembic is only needed by the flask command, not by the workers
+    if os.environ.get('FLASK_RUN_FROM_CLI'):
+        init_migrate(app)
+
+    init_caches(app)
+
+    from app.errors import bp as errors_bp
+    app.register_blueprint(errors_bp)
+
+    from app.auth import bp as auth_bp
+    app.register_blueprint(auth_bp)
+
+    from app.routes import bp as main_bp
+    app.register_blueprint(main_bp)
+
+    from app.metrics import bp as metrics_bp
+    app.register_blueprint(metrics_bp)
+
+    from app.fragments import render_post
+    app.add_template_global(render_post)
+
+    from app.last_seen import last_seen
+    last_seen.init_app(app)
+
+    from app.trending import trending
+    trending.init_app(app)
+
+    from app.events import broker
+    broker.init_app(app)
 
-# errors
-if not app.debug:
+    from app.availability import availability
+    availability.init_app(app)
+
+    if not app.debug and not app.testing:
+        init_logging(app)
+
+    from app.profiler import SamplingProfiler
+    app.wsgi_app = SamplingProfiler(app)
+
+    return app
+
+
+def init_migrate(app: Flask) -> None:
+    """
+    registers the migrations for 'flask db'
+    """
+    from flask_migrate import Migrate
+    Migrate(app, db)
+
+
+def init_caches(app: Flask) -> None:
+    """
+    sizes the process wide caches from the configuration of app
+    """
+    from app.fragments import post_fragments
+    from app.models import follow_graph
+    from app.models import user_cache
+    from app.passwords import hasher
+
+    follow_graph.resize(app.config['FOLLOW_CACHE_MAX_BYTES'])
+    follow_graph.ttl = app.config['FOLLOW_CACHE_TTL']
+    user_cache.resize(app.config['USER_CACHE_SIZE'])
+    user_cache.ttl = app.config['USER_CACHE_TTL']
+    post_fragments.resize(app.config['POST_FRAGMENT_CACHE_SIZE'])
+    hasher.init_app(app)
+
+
+def init_logging(app: Flask) -> None:
+    """
+    file logging, and mail digests of the errors if MAIL_SERVER is set
+    """
+    handlers = []
 
     # mail logging
     if app.config['MAIL_SERVER']:
-        auth = None
-
-        if app.config['MAIL_USERNAME'] \
-                or app.config['MAIL_PASSWORD']:
-            auth = (
-                app.config['MAIL_USERNAME'],
-                app.config['MAIL_PASSWORD']
+        def mail_handler() -> SMTPHandler:
+            auth = None
+
+            if app.config['MAIL_USERNAME'] \
+                    or app.config['MAIL_PASSWORD']:
+                auth = (
+                    app.config['MAIL_USERNAME'],
+                    app.config['MAIL_PASSWORD']
+                )
+
+            secure = None
+
+            if app.config['MAIL_USE_TLS']:
+                secure = ()
+
+            return SMTPHandler(
+                mailhost=(
+                    app.config['MAIL_SERVER'],
+                    app.config['MAIL_PORT']
+                ),
+                fromaddr='no-reply@' + app.config['MAIL_SERVER'],
+                toaddrs=app.config['ADMINS'],
+                subject='Microblog Failure',
+                credentials=auth,
+                secure=secure
             )
 
-        secure = None
-
-        if app.config['MAIL_USE_TLS']:
-            secure = ()
-
-        mail_handler = SMTPHandler(
-            mailhost=(
-                app.config['MAIL_SERVER'],
-                app.config['MAIL_PORT']
-            ),
-            fromaddr='no-reply@' + app.config['MAIL_SERVER'],
-            toaddrs=app.config['ADMINS'],
-            subject='Microblog Failure',
-            credentials=auth,
-            secure=secure
+        # errors are grouped in rate limited digests, the smtp handler is
+        # built when the first one is sent
+        digest_handler = DigestMailHandler(
+            mail_handler,
+            app.config['MAIL_DIGEST_INTERVAL']
         )
-
-        mail_handler.setLevel(logging.ERROR)
-        app.logger.addHandler(mail_handler)
+        digest_handler.setLevel(logging.ERROR)
+        handlers.append(digest_handler)
 
     # file logging
     if not os.path.exists('logs'):
@@ -82,11 +168,13 @@ if not app.debug:
     )
 
     file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    handlers.append(file_handler)
+
+    # the handlers run on a listener thread, requests only enqueue
+    start_pipeline(app.logger, handlers, app.config['LOG_QUEUE_SIZE'])
 
     app.logger.setLevel(logging.INFO)
     app.logger.info('Microblog startup')
 
 
 from app import models
-from app import routes
@@ -0,0 +1,151 @@
+from flask import Blueprint
+from flask import current_app
+from flask import render_template
+from flask import request
+from flask import flash
+from flask import jsonify
+from flask import redirect
+from flask import url_for
+
+from flask_login import current_user
+from flask_login import login_user
+from flask_login import logout_user
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.availability import availability
+from app.forms import LoginForm
+from app.forms import RegistrationForm
+from app.models import User
+from app.pagination import keyset_paginate
+from app.routes import with_authors
+
+bp = Blueprint('auth', __name__)
+
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    # a user already authenticated is redirected to homepage
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+
+    form = LoginForm()
+
+    # redirection on the same page if form invalid
+    if not form.validate_on_submit():
+        return render_template(
+            'login.html',
+            title='Sign In',
+            form=form
+        )
+
+    # query the user
+    usr = User.query.filter_by(
+        username=form.username.data
+    ).first()
+
+    # if credential doesn't match any user, redirect on login
+    if usr is None \
+            or not usr.check_password(form.password.data):
+        flash('Invalid username or password')
+        return redirect(url_for('auth.login'))
+
+    # bring the hash up to the configured cost parameters
+    if usr.upgrade_password(form.password.data):
+        db.session.commit()
+
+    # load the requested user
+    login_user(
+        usr,
+        remember=form.remember_me.data
+    )
+
+    # redirect on previous page or on homepage
+    posts = keyset_paginate(
+        current_user.followed_posts().options(with_authors),
+        current_app.config['POSTS_PER_PAGE'],
+        after=request.args.get('after'),
+        before=request.args.get('before')
+    )
+
+    next_url = url_for(
+        'main.index',
+        after=posts.next_cursor
+    ) if posts.has_next else None
+
+    prev_url = url_for(
+        'main.index',
+        before=posts.prev_cursor
+    ) if posts.has_prev else None
+
+    # user redirected to home page
+    return render_template(
+        'index.html',
+        title='Home',
+        posts=posts.items,
+        next_url=next_url,
+        prev_url=prev_url
+    )
+
+
+@bp.route('/logout')
+def logout():
+    logout_user()
+    return redirect(url_for('main.index'))
+
+
+# noinspection PyArgumentList
+@bp.route('/register', methods=['GET', 'POST'])
+def register():
+    # redirect logged in users to home page
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+
+    form = RegistrationForm()
+    if not form.validate_on_submit():
+        return render_template(
+            'register.html',
+            title='Register',
+            form=form
+        )
+    usr = User(
+        username=form.username.data,
+        email=form.email.data
+    )
+    usr.set_password(
+        form.password.data
+    )
+
+    db.session.add(usr)
+
+    # the availability check may race with another registration
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        flash('Please use a different username or email address.')
+        return redirect(url_for('auth.register'))
+
+    flash('registered successfully !')
+
+    return redirect(url_for('auth.login'))
+
+
+@bp.route('/available')
+def available():
+    """
+    live form validation, e.g. /available?username=susan
+
+    only usernames, which profiles make public anyway, are answered: an
+    email lookup would tell who has an account
+    """
+    username = request.args.get('username')
+
+    if not username:
+        return jsonify({'error': 'username expected'}), 400
+
+    return jsonify({
+        'username': username,
+        'available': not availability.username_taken(username)
+    })
@@ -0,0 +1,158 @@
+import threading
+from hashlib import blake2b
+from math import log
+from time import monotonic
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.models import User
+
+
+class BloomFilter:
+    """
+    set membership with false positives but no false negatives, in
+    about 10 bits per value for a 1% error rate
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.count = 0
+        self.size = max(8, int(-capacity * log(error_rate) / log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str):
+        digest = blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, value: str) -> None:
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(value)
+        )
+
+
+class AvailabilityIndex:
+    """
+    answers 'is this username / email taken ?' from bloom filters, a
+    definite miss skips the database and only possible hits are checked
+
+    the filters are built when the app starts, updated on each insert or
+    update of a user of this process, and rebuilt every
+    AVAILABILITY_REFRESH seconds to catch up with the other processes
+    """
+
+    def __init__(self):
+        self.skipped = 0
+        self.checked = 0
+        self._filters = None
+        self._built_at = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        """
+        builds the filters from the database of app, so that the first
+        sign up doesn't wait for it
+        """
+        with app.app_context(), self._lock:
+            try:
+                self._filters = self.build()
+                self._built_at = monotonic()
+            except OperationalError:
+                # not migrated yet, built on first use
+                pass
+            finally:
+                db.session.remove()
+
+    def _stale(self) -> bool:
+        return self._filters is None or monotonic() - self._built_at \
+            >= current_app.config['AVAILABILITY_REFRESH']
+
+    def _get_filters(self) -> dict:
+        if self._stale():
+            with self._lock:
+                # another thread may have rebuilt them meanwhile
+                if self._stale():
+                    self._filters = self.build()
+                    self._built_at = monotonic()
+
+        return self._filters
+
+    @staticmethod
+    def build() -> dict:
+        count = db.session.query(db.func.count(User.id)).scalar()
+        capacity = max(current_app.config['AVAILABILITY_CAPACITY'], 2 * count)
+        filters = {
+            field: BloomFilter(capacity, current_app.config['AVAILABILITY_ERROR_RATE'])
+            for field in ('username', 'email')
+        }
+
+        rows = db.session.query(User.username, User.email).yield_per(10000)
+        for username, email in rows:
+            filters['username'].add(username or '')
+            filters['email'].add(email or '')
+
+        return filters
+
+    def add(self, username: str, email: str) -> None:
+        filters = self._filters
+        if filters is None:
+            return
+
+        filters['username'].add(username or '')
+        filters['email'].add(email or '')
+
+        # an overfull filter loses precision, rebuild a larger one
+        if filters['username'].count > filters['username'].capacity:
+            self._built_at = 0
+
+    def is_taken(self, field: str, value: str) -> bool:
+        if value not in self._get_filters()[field]:
+            self.skipped += 1
+            return False
+
+        self.checked += 1
+        return db.session.query(User.id).filter(
+            getattr(User, field) == value
+        ).first() is not None
+
+    def username_taken(self, username: str) -> bool:
+        return self.is_taken('username', username)
+
+    def email_taken(self, email: str) -> bool:
+        return self.is_taken('email', email)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._filters = None
+            self.skipped = self.checked = 0
+
+
+availability = AvailabilityIndex()
+
+
+# noinspection PyUnusedLocal
+@event.listens_for(User, 'after_insert')
+def index_user(mapper, connection, target):
+    availability.add(target.username, target.email)
+
+
+# noinspection PyUnusedLocal
+@event.listens_for(User, 'after_update')
+def reindex_user(mapper, connection, target):
+    # most updates are last_seen and counter writes
+    attrs = db.inspect(target).attrs
+    if attrs.username.history.has_changes() \
+            or attrs.email.history.has_changes():
+        availability.add(target.username, target.email)
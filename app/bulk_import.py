@@ -0,0 +1,162 @@
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+from time import perf_counter
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.models import Post, User, email_digest, followers
+from app.search import drop_triggers
+from app.search import rebuild_index
+
+
+def read_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        yield {key: value for key, value in row.items() if value != ''}
+
+
+def parse_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def with_id(record: dict, row: dict) -> dict:
+    """
+    keeps the source primary key when the record has one
+    """
+    if record.get('id') is not None:
+        row['id'] = int(record['id'])
+    return row
+
+
+def user_row(record: dict) -> dict:
+    email = record.get('email')
+    return with_id(record, {
+        'username': record['username'],
+        'email': email,
+        'avatar_hash': email_digest(email) if email else None,
+        'password_hash': record.get('password_hash'),
+        'about_me': record.get('about_me'),
+        'last_seen': parse_datetime(record.get('last_seen'))
+    })
+
+
+def follow_row(record: dict) -> dict:
+    return {
+        'follower_id': int(record['follower_id']),
+        'followed_id': int(record['followed_id'])
+    }
+
+
+def post_row(record: dict) -> dict:
+    return with_id(record, {
+        'body': record['body'],
+        'user_id': int(record['user_id']),
+        'timestamp': parse_datetime(record.get('timestamp'))
+        or datetime.utcnow()
+    })
+
+
+# kind -> (target table, record converter)
+IMPORTERS = {
+    'users': (User.__table__, user_row),
+    'follows': (followers, follow_row),
+    'posts': (Post.__table__, post_row),
+}
+
+
+def import_rows(kind: str, records, batch_size: int = 5000,
+                commit_every: int = 200000, drop_indexes: bool = False,
+                progress=None) -> dict:
+    """
+    inserts the records with one executemany per batch, committing every
+    commit_every rows
+
+    :param kind: one of IMPORTERS
+    :param records: iterable of dicts, consumed lazily
+    :param drop_indexes: drop the secondary indexes of the table during
+        the load and build them once at the end, as well as the search
+        index for posts
+    :param progress: called with the number of rows inserted so far
+    :return: the number of rows and the elapsed time
+    """
+    table, convert = IMPORTERS[kind]
+    statement = table.insert()
+    if kind == 'follows':
+        statement = statement.prefix_with('OR IGNORE', dialect='sqlite')
+
+    # the unique indexes stay, they reject the duplicates
+    indexes = [
+        index for index in table.indexes if not index.unique
+    ] if drop_indexes else []
+    search = drop_indexes and kind == 'posts' \
+        and db.engine.dialect.name == 'sqlite'
+    rows = 0
+    start = perf_counter()
+    records = iter(records)
+
+    with db.engine.connect() as connection:
+        for index in indexes:
+            index.drop(connection)
+
+        if search:
+            drop_triggers(connection)
+
+        transaction = connection.begin()
+        try:
+            while True:
+                batch = [
+                    convert(record)
+                    for record in islice(records, batch_size)
+                ]
+                if not batch:
+                    break
+
+                # executemany needs the same keys in every row
+                if any(row.keys() != batch[0].keys() for row in batch):
+                    raise ValueError(
+                        'ids must be given for all the records or none'
+                    )
+
+                connection.execute(statement, batch)
+                rows += len(batch)
+
+                if rows % commit_every < len(batch):
+                    transaction.commit()
+                    transaction = connection.begin()
+
+                if progress is not None:
+                    progress(rows)
+
+            transaction.commit()
+        except Exception:
+            transaction.rollback()
+            raise
+        finally:
+            for index in indexes:
+                try:
+                    index.create(connection)
+                except SQLAlchemyError as error:
+                    raise RuntimeError(
+                        'could not rebuild index {}'.format(index.name)
+                    ) from error
+
+            if search:
+                rebuild_index(connection)
+
+    elapsed = perf_counter() - start
+    return {
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed if elapsed else 0.0
+    }
@@ -0,0 +1,132 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class LRUCache:
+    """
+    thread safe mapping bounded by a total weight, evicting the least
+    recently used entries first
+
+    the weight of an entry defaults to 1, so that max_weight is an entry
+    count, or can be its size in bytes to cap the memory used
+    """
+
+    def __init__(self, max_weight: int):
+        self.max_weight = max_weight
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, weight: int = 1) -> None:
+        if weight > self.max_weight:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.weight -= self._entries.pop(key)[1]
+
+            self._entries[key] = (value, weight)
+            self.weight += weight
+
+            while self.weight > self.max_weight:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.weight -= evicted
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+
+            value, weight = self._entries.pop(key)
+            self.weight -= weight
+            return value
+
+    def resize(self, max_weight: int) -> None:
+        """
+        changes the bound, evicting the entries over it
+        """
+        with self._lock:
+            self.max_weight = max_weight
+
+            while self.weight > self.max_weight:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.weight -= evicted
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """
+        drops every entry and resets the statistics
+        """
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'weight': self.weight,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+class TTLCache(LRUCache):
+    """
+    LRUCache whose entries expire ttl seconds after being set
+    """
+
+    def __init__(self, max_weight: int, ttl: float):
+        super(TTLCache, self).__init__(max_weight)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                (expires, value), weight = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires <= monotonic():
+                del self._entries[key]
+                self.weight -= weight
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, weight: int = 1) -> None:
+        super(TTLCache, self).set(key, (monotonic() + self.ttl, value), weight)
+
+    def pop(self, key, default=None):
+        entry = super(TTLCache, self).pop(key)
+        return default if entry is None else entry[1]
@@ -0,0 +1,282 @@
+import threading
+from functools import partial
+from functools import wraps
+from itertools import count
+from time import monotonic
+from time import time
+
+from flask import current_app
+from flask import g
+from flask import has_request_context
+from flask import request
+from flask import session
+from flask_sqlalchemy import SignallingSession
+from flask_sqlalchemy import SQLAlchemy as _SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy import orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+
+# configuration key of each pragma, busy_timeout first as changing the
+# journal mode needs a lock
+SQLITE_PRAGMAS = (
+    ('busy_timeout', 'SQLITE_BUSY_TIMEOUT'),
+    ('journal_mode', 'SQLITE_JOURNAL_MODE'),
+    ('synchronous', 'SQLITE_SYNCHRONOUS'),
+    ('mmap_size', 'SQLITE_MMAP_SIZE'),
+    ('cache_size', 'SQLITE_CACHE_SIZE'),
+    ('temp_store', 'SQLITE_TEMP_STORE')
+)
+
+# flask session key of the time of the user's last write
+LAST_WRITE_KEY = '_db_last_write'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+POOL_OPTIONS = (
+    ('pool_size', 'DATABASE_POOL_SIZE'),
+    ('max_overflow', 'DATABASE_MAX_OVERFLOW'),
+    ('pool_timeout', 'DATABASE_POOL_TIMEOUT'),
+    ('pool_recycle', 'DATABASE_POOL_RECYCLE')
+)
+
+
+def sqlite_pragmas(config) -> list:
+    """
+    :return: the (pragma, value) pairs configured, in the order to set them
+    """
+    return [
+        (pragma, config[key])
+        for pragma, key in SQLITE_PRAGMAS
+        if config.get(key) is not None
+    ]
+
+
+# noinspection PyUnusedLocal
+def set_pragmas(dbapi_connection, connection_record, pragmas):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in pragmas:
+        cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+    cursor.close()
+
+
+def use_primary(view):
+    """
+    sends the reads of the view to the primary, for the GET views writing
+    after reading
+    """
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        g.db_primary = True
+        return view(*args, **kwargs)
+
+    return decorated_view
+
+
+class ReplicaSet:
+    """
+    read replica engines taken in turn, a replica that failed is skipped
+    for `retry_interval` seconds
+    """
+
+    def __init__(self, engines: list, retry_interval: float):
+        self.engines = engines
+        self.retry_interval = retry_interval
+        self.reads = 0
+        self.failovers = 0
+        self._down_until = {}
+        self._turn = count()
+        self._lock = threading.Lock()
+
+    def pick(self):
+        """
+        :return: the next available replica, None if there are none
+        """
+        now = monotonic()
+
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self._turn) % len(self.engines)]
+            if self._down_until.get(engine, 0) <= now:
+                with self._lock:
+                    self.reads += 1
+                return engine
+
+        return None
+
+    def mark_down(self, engine) -> None:
+        with self._lock:
+            self._down_until[engine] = monotonic() + self.retry_interval
+            self.failovers += 1
+
+    def dispose(self) -> None:
+        for engine in self.engines:
+            engine.dispose()
+
+
+class RoutingSession(SignallingSession):
+    """
+    sends the SELECTs of a request to a read replica, unless the request
+    is pinned to the primary: any other method than GET, a write earlier
+    in the request or, through the flask session, by the same user less
+    than DATABASE_READ_YOUR_WRITES seconds ago
+
+    a read failing on a replica marks it down and is run again on another
+    replica or on the primary; outside of requests everything goes to the
+    primary
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        self.replica = None
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        bind = super(RoutingSession, self).get_bind(mapper, clause)
+        self.replica = None
+
+        # models with a __bind_key__ are not replicated
+        if bind is not self.bind or not has_request_context():
+            return bind
+
+        if self._flushing or getattr(clause, 'is_dml', False):
+            g.db_primary = g.db_wrote = True
+            return bind
+
+        read = getattr(clause, 'is_select', False) \
+            and getattr(clause, '_for_update_arg', None) is None
+
+        if not read or g.get('db_primary', True):
+            return bind
+
+        self.replica = self.db.get_replicas(self.app).pick()
+        return self.replica or bind
+
+    def execute(self, *args, **kwargs):
+        while True:
+            try:
+                return super(RoutingSession, self).execute(*args, **kwargs)
+            except OperationalError:
+                if self.replica is None:
+                    raise
+
+                current_app.logger.warning(
+                    'read replica %s failed, reading from the primary',
+                    self.replica.url,
+                    exc_info=True
+                )
+                self.db.get_replicas(self.app).mark_down(self.replica)
+
+
+class SQLAlchemy(_SQLAlchemy):
+    """
+    pools the connections as set by DATABASE_POOL_SIZE..., including for
+    a SQLite file which flask_sqlalchemy opens anew on each checkout, and
+    sets the SQLITE_* pragmas on each new SQLite connection
+
+    the reads of the requests are routed to DATABASE_REPLICA_URLS, see
+    RoutingSession
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._replicas_lock = threading.Lock()
+        super(SQLAlchemy, self).__init__(*args, **kwargs)
+
+    def init_app(self, app):
+        super(SQLAlchemy, self).init_app(app)
+
+        if app.config.get('DATABASE_REPLICA_URLS'):
+            app.before_request(self.route_request)
+            app.after_request(self.remember_write)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def get_replicas(self, app=None) -> ReplicaSet:
+        """
+        :return: the read replicas of the app, connected on first use
+        """
+        app = self.get_app(app)
+        replicas = app.extensions.get('sqlalchemy_replicas')
+
+        if replicas is None:
+            with self._replicas_lock:
+                replicas = app.extensions.get('sqlalchemy_replicas')
+                if replicas is None:
+                    replicas = ReplicaSet(
+                        [
+                            self.create_replica_engine(app, url)
+                            for url in app.config.get(
+                                'DATABASE_REPLICA_URLS'
+                            ) or ()
+                        ],
+                        app.config['DATABASE_REPLICA_RETRY']
+                    )
+                    app.extensions['sqlalchemy_replicas'] = replicas
+
+        return replicas
+
+    def create_replica_engine(self, app, url: str):
+        sa_url, options = self.apply_driver_hacks(
+            app,
+            make_url(url),
+            dict(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        )
+
+        # a SQLite replica is a copy, it must not diverge
+        if 'sqlite_pragmas' in options:
+            options['sqlite_pragmas'].append(('query_only', 'ON'))
+
+        return self.create_engine(sa_url, options)
+
+    @staticmethod
+    def route_request() -> None:
+        last_write = session.get(LAST_WRITE_KEY)
+        recent = last_write is not None and time() - last_write \
+            < current_app.config['DATABASE_READ_YOUR_WRITES']
+
+        g.db_primary = request.method not in SAFE_METHODS or recent
+        g.db_wrote = False
+
+    @staticmethod
+    def remember_write(response):
+        if g.get('db_wrote'):
+            session[LAST_WRITE_KEY] = time()
+
+        return response
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sqlite = sa_url.drivername.startswith('sqlite')
+        in_memory = sqlite and sa_url.database in (None, '', ':memory:')
+
+        # an in memory database lives in its single connection
+        if not in_memory and app.config.get('DATABASE_POOL_SIZE'):
+            for option, key in POOL_OPTIONS:
+                options.setdefault(option, app.config[key])
+
+        sa_url, options = super(SQLAlchemy, self).apply_driver_hacks(
+            app, sa_url, options
+        )
+
+        if sqlite and not in_memory and options.get('pool_size'):
+            # a pooled connection is used by one thread at a time
+            options['poolclass'] = QueuePool
+            options.setdefault('connect_args', {})['check_same_thread'] = False
+
+        if sqlite:
+            options['sqlite_pragmas'] = sqlite_pragmas(app.config)
+
+        return sa_url, options
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop('sqlite_pragmas', None)
+        engine = super(SQLAlchemy, self).create_engine(sa_url, engine_opts)
+
+        if pragmas:
+            event.listen(
+                engine,
+                'connect',
+                partial(set_pragmas, pragmas=pragmas)
+            )
+
+        return engine
@@ -0,0 +1,33 @@
+from flask import Blueprint
+from flask import render_template
+
+from app import db
+from app.events import BrokerFull
+from app.passwords import PasswordHasherBusy
+
+bp = Blueprint('errors', __name__)
+
+
+# noinspection PyUnusedLocal
+@bp.app_errorhandler(404)
+def not_found_error(error):
+    return render_template('404.html'), 404
+
+
+# noinspection PyUnusedLocal
+@bp.app_errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    return render_template('503.html'), 503, {'Retry-After': '5'}
+
+
+# noinspection PyUnusedLocal
+@bp.app_errorhandler(BrokerFull)
+def broker_full(error):
+    return render_template('503.html'), 503, {'Retry-After': '30'}
+
+
+# noinspection PyUnusedLocal
+@bp.app_errorhandler(500)
+def internal_error(error):
+    db.session.rollback()
+    return render_template('500.html'), 500
@@ -0,0 +1,58 @@
+from hashlib import sha1
+
+from flask import make_response
+from flask import request
+from flask import session
+from flask_login import current_user
+
+from app import db
+from app.models import Post
+
+
+def newest_post_id():
+    """
+    cheap change marker of the feeds, read from the primary key index
+    """
+    return db.session.query(db.func.max(Post.id)).scalar()
+
+
+def feed_etag(*parts) -> str:
+    """
+    strong validator of a feed page, from the given change markers, the
+    viewer (shown in the navigation bar) and the page cursor
+    """
+    key = (
+        request.endpoint,
+        current_user.id,
+        current_user.username,
+        request.args.get('after'),
+        request.args.get('before')
+    ) + parts
+
+    return sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def not_modified(etag: str):
+    """
+    :return: a 304 response if the client's copy is still valid, None if
+        the page has to be rendered
+    """
+    # flashed messages are only rendered once
+    if '_flashes' in session:
+        return None
+
+    if not request.if_none_match.contains(etag):
+        return None
+
+    return tagged(make_response('', 304), etag)
+
+
+def tagged(response, etag: str):
+    """
+    sets the validator, clients must revalidate the private copy they keep
+    """
+    response = make_response(response)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,330 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+
+from flask import current_app
+
+# datagrams carry one event, posts are at most POST_LEN characters
+MAX_DATAGRAM = 64 * 1024
+
+
+class Subscriber:
+    """
+    bounded queue of the events of some topics, when it is full the
+    oldest event is dropped and counted in `dropped`
+    """
+
+    def __init__(self, topics, size: int):
+        self.topics = frozenset(topics)
+        self.dropped = 0
+        self._queue = queue.Queue(size)
+
+    def put(self, event) -> bool:
+        """
+        :return: False if an older event had to be dropped
+        """
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            pass
+
+        try:
+            self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.dropped += 1
+
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+        return False
+
+    def get(self, timeout: float):
+        """
+        :return: the next event, None after timeout seconds without any
+        """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class BrokerFull(Exception):
+    """
+    raised when EVENTS_MAX_SUBSCRIBERS streams are already open
+    """
+
+
+class SocketBridge:
+    """
+    relays the events between the worker processes of a host, through
+    one unix datagram socket per process in directory, named after the
+    process id by default
+
+    sends never block: a peer whose socket buffer is full misses the
+    event, which is counted in `dropped`, and the sockets of exited
+    processes are removed; malformed datagrams are logged and skipped
+    """
+
+    def __init__(self, directory: str, deliver, name: str = None,
+                 logger: logging.Logger = None):
+        self.directory = directory
+        self.deliver = deliver
+        self.name = name
+        self.logger = logger or logging.getLogger(__name__)
+        self.path = None
+        self.dropped = 0
+        self._receiver = None
+        self._sender = None
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(
+            self.directory,
+            '{}.sock'.format(self.name or os.getpid())
+        )
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._receiver.bind(self.path)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+
+        threading.Thread(
+            target=self._receive,
+            name='events-bridge',
+            daemon=True
+        ).start()
+
+    def close(self) -> None:
+        if self.path is None:
+            return
+
+        for sock in (self._receiver, self._sender):
+            sock.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.path = None
+
+    def send(self, topic: int, event: dict) -> None:
+        data = json.dumps([topic, event]).encode('utf-8')
+        own = os.path.basename(self.path)
+
+        for name in os.listdir(self.directory):
+            if name == own or not name.endswith('.sock'):
+                continue
+
+            peer = os.path.join(self.directory, name)
+            try:
+                self._sender.sendto(data, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.remove(peer)
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                self.dropped += 1
+
+    def _receive(self) -> None:
+        while True:
+            try:
+                data = self._receiver.recv(MAX_DATAGRAM)
+            except OSError:
+                # closed
+                return
+
+            try:
+                topic, event = json.loads(data.decode('utf-8'))
+            except (ValueError, TypeError):
+                self.logger.error('malformed event datagram: %r', data[:200])
+                continue
+
+            self.deliver(topic, event)
+
+
+class Broker:
+    """
+    in process publish / subscribe of events by topic, the topic of a post
+    is its author id
+
+    each subscriber has its own bounded queue so a slow client only loses
+    its own events; with EVENTS_SOCKET_DIR set the events published by
+    the other worker processes are relayed through a SocketBridge
+    """
+
+    def __init__(self):
+        self.app = None
+        self.published = 0
+        self.delivered = 0
+        self.rejected = 0
+        # events dropped by the closed subscribers
+        self._dropped = 0
+        self._subscribers = set()
+        self._topics = {}
+        self._lock = threading.Lock()
+        self._bridge = None
+        self._pid = None
+
+    def init_app(self, app) -> None:
+        if self.app is None:
+            atexit.register(self.close)
+
+        self.app = app
+
+    def _bridged(self):
+        """
+        :return: the bridge of this process, started on first use as the
+            app may be created before the workers fork
+        """
+        directory = self.app.config.get('EVENTS_SOCKET_DIR') \
+            if self.app is not None else None
+        if not directory or not hasattr(socket, 'AF_UNIX'):
+            return None
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._bridge = SocketBridge(
+                    directory,
+                    self.deliver,
+                    logger=self.app.logger
+                )
+                self._bridge.start()
+
+        return self._bridge
+
+    def close(self) -> None:
+        if self._bridge is not None and self._pid == os.getpid():
+            self._bridge.close()
+        self._bridge = None
+        self._pid = None
+
+    def subscribe(self, topics) -> Subscriber:
+        """
+        :raise BrokerFull: when EVENTS_MAX_SUBSCRIBERS are subscribed
+        """
+        self._bridged()
+        subscriber = Subscriber(
+            topics,
+            current_app.config['EVENTS_QUEUE_SIZE']
+        )
+
+        with self._lock:
+            if len(self._subscribers) \
+                    >= current_app.config['EVENTS_MAX_SUBSCRIBERS']:
+                self.rejected += 1
+                raise BrokerFull()
+
+            self._subscribers.add(subscriber)
+            for topic in subscriber.topics:
+                self._topics.setdefault(topic, set()).add(subscriber)
+
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self._lock:
+            if subscriber not in self._subscribers:
+                return
+
+            self._subscribers.discard(subscriber)
+            self._dropped += subscriber.dropped
+            for topic in subscriber.topics:
+                subscribers = self._topics.get(topic)
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._topics[topic]
+
+    def publish(self, topic: int, event: dict) -> None:
+        """
+        deliver event to the subscribers of topic in every worker
+        """
+        with self._lock:
+            self.published += 1
+
+        bridge = self._bridged()
+        if bridge is not None:
+            bridge.send(topic, event)
+
+        self.deliver(topic, event)
+
+    def deliver(self, topic: int, event: dict) -> None:
+        """
+        deliver event to the subscribers of topic in this process
+        """
+        with self._lock:
+            subscribers = list(self._topics.get(topic, ()))
+
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+        with self._lock:
+            self.delivered += len(subscribers)
+
+    def stream(self, subscriber: Subscriber, keepalive: float):
+        """
+        server-sent events of a subscriber; a comment is sent every
+        keepalive seconds without events, and an 'overflow' event after
+        events were dropped
+
+        the caller unsubscribes when the response is closed, the stream
+        may never be iterated
+        """
+        reported = 0
+        yield 'retry: 5000\n\n'
+        while True:
+            event = subscriber.get(keepalive)
+
+            if subscriber.dropped > reported:
+                yield format_event(
+                    'overflow',
+                    {'dropped': subscriber.dropped - reported}
+                )
+                reported = subscriber.dropped
+
+            if event is None:
+                yield ': keepalive\n\n'
+            else:
+                yield format_event('post', event)
+
+    def stats(self) -> dict:
+        with self._lock:
+            dropped = self._dropped + sum(
+                subscriber.dropped for subscriber in self._subscribers
+            )
+            return {
+                'subscribers': len(self._subscribers),
+                'published': self.published,
+                'delivered': self.delivered,
+                'dropped': dropped,
+                'rejected': self.rejected,
+                'bridge_dropped': self._bridge.dropped
+                if self._bridge is not None else 0
+            }
+
+
+def post_event(post) -> dict:
+    return {
+        'id': post.id,
+        'author': post.author.username,
+        'body': post.body,
+        'timestamp': post.timestamp.isoformat() + 'Z'
+    }
+
+
+def format_event(name: str, data: dict) -> str:
+    """
+    :return: a server-sent event
+    """
+    return 'event: {}\ndata: {}\n\n'.format(name, json.dumps(data))
+
+
+broker = Broker()
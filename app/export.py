@@ -0,0 +1,162 @@
+import csv
+import json
+import zlib
+from io import StringIO
+
+from app import db
+from app.models import Post, User, followers
+
+# rows fetched per round trip
+BATCH_SIZE = 1000
+
+# bytes gathered before a chunk is yielded
+CHUNK_SIZE = 64 * 1024
+
+
+def post_rows(usr_id: int):
+    query = db.session.query(
+        Post.id,
+        Post.user_id,
+        Post.body,
+        Post.timestamp
+    ).filter(
+        Post.user_id == usr_id
+    ).order_by(
+        # the order of ix_post_user_id_timestamp, nothing to sort
+        Post.timestamp,
+        Post.id
+    )
+
+    for post_id, user_id, body, timestamp in query.yield_per(BATCH_SIZE):
+        yield {
+            'id': post_id,
+            'user_id': user_id,
+            'body': body,
+            'timestamp': timestamp.isoformat() if timestamp else None
+        }
+
+
+def follow_rows(usr_id: int, column, other):
+    """
+    the follows where column is the user, with the username of the other
+    side
+
+    the rows come in the order of the index on column, sorting them
+    would buffer them all
+    """
+    query = db.session.query(
+        followers.c.follower_id,
+        followers.c.followed_id,
+        User.username
+    ).join(
+        User,
+        User.id == other
+    ).filter(
+        column == usr_id
+    )
+
+    for follower_id, followed_id, username in query.yield_per(BATCH_SIZE):
+        yield {
+            'follower_id': follower_id,
+            'followed_id': followed_id,
+            'username': username
+        }
+
+
+def follower_rows(usr_id: int):
+    return follow_rows(
+        usr_id,
+        followers.c.followed_id,
+        followers.c.follower_id
+    )
+
+
+def followed_rows(usr_id: int):
+    return follow_rows(
+        usr_id,
+        followers.c.follower_id,
+        followers.c.followed_id
+    )
+
+
+# kind -> (fields, rows of a user); the files are accepted by 'flask
+# import' as posts and follows
+EXPORTS = {
+    'posts': (('id', 'user_id', 'body', 'timestamp'), post_rows),
+    'followers': (('follower_id', 'followed_id', 'username'), follower_rows),
+    'followed': (('follower_id', 'followed_id', 'username'), followed_rows),
+}
+
+
+def ndjson_lines(rows, fields):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def csv_lines(rows, fields):
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fields)
+    writer.writeheader()
+
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+# format -> (line writer, mimetype)
+FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
+
+
+def chunked(lines):
+    """
+    joins the lines into utf-8 chunks of about CHUNK_SIZE bytes
+    """
+    pending = []
+    size = 0
+
+    for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(pending).encode('utf-8')
+            pending = []
+            size = 0
+
+    if pending:
+        yield ''.join(pending).encode('utf-8')
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+def export_rows(kind: str, usr_id: int, fmt: str = 'ndjson',
+                compress: bool = False):
+    """
+    streams the rows of a user in constant memory, they are read by
+    batches of BATCH_SIZE
+
+    :param kind: one of EXPORTS
+    :param fmt: one of FORMATS
+    :param compress: gzip the output
+    :return: iterator of bytes
+    """
+    fields, rows = EXPORTS[kind]
+    lines, _ = FORMATS[fmt]
+    chunks = chunked(lines(rows(usr_id), fields))
+
+    return gzipped(chunks) if compress else chunks
@@ -12,7 +12,7 @@ from wtforms.validators import Length
 from wtforms.validators import EqualTo
 from wtforms.validators import Email
 
-from app.models import User
+from app.availability import availability
 
 
 PASSWORD_MIN_LEN = 8
@@ -62,21 +62,13 @@ class RegistrationForm(FlaskForm):
 
     # noinspection PyMethodMayBeStatic
     def validate_username(self, username) -> None:
-        user = User.query.filter_by(
-            username=username.data
-        ).first()
-
-        if user is not None:
+        if availability.username_taken(username.data):
             raise ValidationError('Please use a different username.')
 
     # noinspection PyMethodMayBeStatic
     def validate_email(self, email) -> None:
         # TODO implements check -> https://haveibeenpwned.com
-        user = User.query.filter_by(
-            email=email.data
-        ).first()
-
-        if user is not None:
+        if availability.email_taken(email.data):
             raise ValidationError('Please use a different email address.')
 
     def validate_password(self, password) -> None:
@@ -104,12 +96,9 @@ class EditProfileForm(FlaskForm):
         """
         prevent username duplication
         """
-        if username.data != self.original_username:
-            user = User.query.filter_by(
-                username=self.username.data
-            ).first()
-            if user is not None:
-                raise ValidationError('Please use a different username.')
+        if username.data != self.original_username \
+                and availability.username_taken(username.data):
+            raise ValidationError('Please use a different username.')
 
 
 class PostForm(FlaskForm):
@@ -0,0 +1,24 @@
+from flask import render_template
+from markupsafe import Markup
+
+from app.cache import LRUCache
+from config import Config
+
+# rendered _post.html, by post and by the author fields it displays,
+# resized by create_app
+post_fragments = LRUCache(Config.POST_FRAGMENT_CACHE_SIZE)
+
+
+def render_post(post) -> Markup:
+    """
+    renders a post of a feed, a post never changes once created so only an
+    edit of its author's profile invalidates it
+    """
+    key = (post.id, post.author.username, post.author.avatar_hash)
+    html = post_fragments.get(key)
+
+    if html is None:
+        html = Markup(render_template('_post.html', post=post))
+        post_fragments.set(key, html)
+
+    return html
@@ -0,0 +1,121 @@
+import atexit
+import threading
+from datetime import datetime
+from datetime import timedelta
+from time import monotonic
+
+from flask import current_app
+
+from app import db
+from app.models import User
+
+
+class LastSeenBuffer:
+    """
+    coalesces 'last seen' updates in memory and writes them in batches
+
+    only the latest timestamp of each user is kept, the buffer is flushed
+    as a single executemany UPDATE once LAST_SEEN_FLUSH_INTERVAL seconds
+    have elapsed or LAST_SEEN_FLUSH_SIZE users are pending; with an app,
+    a timer flushes the updates of an idle process
+    """
+
+    def __init__(self):
+        self.app = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = monotonic()
+        self._timer = None
+
+    def init_app(self, app) -> None:
+        """
+        the pending timestamps are written to the database of app, also
+        when the process exits
+        """
+        if self.app is None:
+            atexit.register(self.flush)
+
+        self.app = app
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, usr: User, seen: datetime = None) -> None:
+        """
+        record an activity of the user, skipped if the stored value is
+        more recent than LAST_SEEN_GRANULARITY seconds
+        """
+        seen = seen or datetime.utcnow()
+        granularity = timedelta(
+            seconds=current_app.config['LAST_SEEN_GRANULARITY']
+        )
+
+        if usr.last_seen is not None \
+                and seen - usr.last_seen < granularity:
+            return
+
+        interval = current_app.config['LAST_SEEN_FLUSH_INTERVAL']
+        with self._lock:
+            self._pending[usr.id] = seen
+            due = len(self._pending) >= current_app.config['LAST_SEEN_FLUSH_SIZE'] \
+                or monotonic() - self._last_flush >= interval
+
+            if not due:
+                self._schedule(interval)
+
+        if due:
+            self.flush()
+
+    def _schedule(self, interval: float) -> None:
+        """
+        start the timer of the next flush, unless one is running, the
+        threads of a forked parent are not
+        """
+        if self.app is None \
+                or self._timer is not None and self._timer.is_alive():
+            return
+
+        self._timer = threading.Timer(interval, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def get(self, usr_id: int):
+        """
+        :return: the buffered timestamp of the user, None if not pending
+        """
+        return self._pending.get(usr_id)
+
+    def flush(self) -> int:
+        """
+        write every pending timestamp
+
+        :return: the number of users updated
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = monotonic()
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+
+        if not pending:
+            return 0
+
+        table = User.__table__
+        with db.get_engine(self.app).begin() as connection:
+            connection.execute(
+                table.update().where(
+                    table.c.id == db.bindparam('usr_id')
+                ).values(
+                    last_seen=db.bindparam('seen')
+                ),
+                [
+                    {'usr_id': usr_id, 'seen': seen}
+                    for usr_id, seen in pending.items()
+                ]
+            )
+
+        return len(pending)
+
+
+last_seen = LastSeenBuffer()
@@ -0,0 +1,154 @@
+import atexit
+import logging
+import queue
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from time import monotonic
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    enqueues the records without ever blocking the logging thread,
+    records are dropped and counted while the queue is full
+    """
+
+    def __init__(self, records: queue.Queue):
+        super(DroppingQueueHandler, self).__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the traceback is merged into the message by prepare(), keep
+        # what identifies the error for the digests
+        record.fingerprint = '{} in {}:{}'.format(
+            record.exc_info[0].__name__
+            if record.exc_info and record.exc_info[0]
+            else record.levelname,
+            record.pathname,
+            record.lineno
+        )
+        return super(DroppingQueueHandler, self).prepare(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DigestMailHandler(logging.Handler):
+    """
+    coalesces the records into digests grouped by fingerprint, sent
+    through an SMTPHandler at most once every `interval` seconds
+
+    the SMTPHandler is only built, by build_mail_handler, when the first
+    digest is sent
+    """
+
+    # distinct errors detailed in a digest, the others are only counted
+    MAX_GROUPS = 50
+
+    def __init__(self, build_mail_handler, interval: float):
+        super(DigestMailHandler, self).__init__()
+        self.build_mail_handler = build_mail_handler
+        self.mail_handler = None
+        self.interval = interval
+        self._groups = {}
+        self._last_sent = None
+        self._timer = None
+        self._groups_lock = threading.Lock()
+
+    def emit(self, record):
+        fingerprint = getattr(record, 'fingerprint', record.getMessage())
+        seen = datetime.utcfromtimestamp(record.created)
+
+        with self._groups_lock:
+            group = self._groups.get(fingerprint)
+            if group is not None:
+                group['count'] += 1
+                group['last'] = seen
+            elif len(self._groups) < self.MAX_GROUPS:
+                self._groups[fingerprint] = {
+                    'count': 1,
+                    'first': seen,
+                    'last': seen,
+                    'sample': record.getMessage()
+                }
+            else:
+                self._groups.setdefault(
+                    'other errors',
+                    {'count': 0, 'first': seen, 'last': seen, 'sample': ''}
+                )['count'] += 1
+                self._groups['other errors']['last'] = seen
+
+            due = self._last_sent is None \
+                or monotonic() - self._last_sent >= self.interval
+
+            if not due and self._timer is None:
+                delay = self.interval - (monotonic() - self._last_sent)
+                self._timer = threading.Timer(delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._groups_lock:
+            groups, self._groups = self._groups, {}
+            self._timer = None
+            if not groups:
+                return
+            self._last_sent = monotonic()
+
+        if self.mail_handler is None:
+            self.mail_handler = self.build_mail_handler()
+
+        self.mail_handler.handle(self.digest(groups))
+
+    @staticmethod
+    def digest(groups: dict) -> logging.LogRecord:
+        total = sum(group['count'] for group in groups.values())
+        lines = []
+
+        for fingerprint, group in sorted(
+                groups.items(),
+                key=lambda item: -item[1]['count']):
+            lines.append('{} x {}'.format(group['count'], fingerprint))
+            lines.append('  first {:%Y-%m-%d %H:%M:%S}, '
+                         'last {:%Y-%m-%d %H:%M:%S} UTC'.format(
+                             group['first'], group['last']))
+            if group['sample']:
+                lines.append('  ' + group['sample'].replace('\n', '\n  '))
+            lines.append('')
+
+        record = logging.makeLogRecord({
+            'name': 'microblog.digest',
+            'levelno': logging.ERROR,
+            'levelname': 'ERROR',
+            'msg': '{} errors, {} distinct\n\n{}'.format(
+                total, len(groups), '\n'.join(lines)
+            )
+        })
+        return record
+
+    def close(self):
+        self.flush()
+        super(DigestMailHandler, self).close()
+
+
+def start_pipeline(logger: logging.Logger, handlers: list,
+                   size: int) -> QueueListener:
+    """
+    moves the handlers behind a queue served by a listener thread, the
+    logger only enqueues records
+    """
+    records = queue.Queue(maxsize=size)
+    logger.addHandler(DroppingQueueHandler(records))
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    return listener
@@ -0,0 +1,188 @@
+import threading
+from time import perf_counter
+
+from flask import Blueprint
+from flask import Response
+from flask import current_app
+from flask import g
+from flask import has_request_context
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.events import broker
+from app.fragments import post_fragments
+from app.models import follow_graph
+from app.models import user_cache
+from app.passwords import hasher
+
+bp = Blueprint('metrics', __name__)
+
+TIME_BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """
+    prometheus style histogram, with one series per label value
+    """
+
+    def __init__(self, name: str, doc: str, label: str, buckets):
+        self.name = name
+        self.doc = doc
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float) -> None:
+        with self._lock:
+            counts, total = self._series.get(
+                label_value,
+                ([0] * (len(self.buckets) + 1), 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._series[label_value] = (counts, total + value)
+
+    def exposition(self) -> list:
+        lines = [
+            '# HELP {} {}'.format(self.name, self.doc),
+            '# TYPE {} histogram'.format(self.name)
+        ]
+
+        with self._lock:
+            series = sorted(self._series.items())
+
+        for value, (counts, total) in series:
+            labels = '{}="{}"'.format(self.label, value)
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    self.name, labels, bound, count
+                ))
+            lines.append('{}_sum{{{}}} {}'.format(self.name, labels, total))
+            lines.append('{}_count{{{}}} {}'.format(
+                self.name, labels, counts[-1]
+            ))
+
+        return lines
+
+
+request_seconds = Histogram(
+    'microblog_request_seconds',
+    'Time spent handling the request.',
+    'endpoint',
+    TIME_BUCKETS
+)
+request_queries = Histogram(
+    'microblog_request_queries',
+    'SQL statements issued by the request.',
+    'endpoint',
+    QUERY_BUCKETS
+)
+request_db_seconds = Histogram(
+    'microblog_request_db_seconds',
+    'Time spent in SQL statements by the request.',
+    'endpoint',
+    TIME_BUCKETS
+)
+
+
+# noinspection PyUnusedLocal
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_start'] = perf_counter()
+
+
+# noinspection PyUnusedLocal
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info.pop('query_start')
+
+    if not has_request_context() or 'sql' not in g:
+        return
+
+    stats = g.sql
+    stats['queries'] += 1
+    stats['seconds'] += elapsed
+    if elapsed > stats['slowest'][0]:
+        stats['slowest'] = (elapsed, statement)
+
+
+@bp.before_app_request
+def start_request():
+    g.request_start = perf_counter()
+    g.sql = {'queries': 0, 'seconds': 0.0, 'slowest': (0.0, None)}
+
+
+# noinspection PyUnusedLocal
+@bp.teardown_app_request
+def end_request(error=None):
+    if 'request_start' not in g:
+        return
+
+    elapsed = perf_counter() - g.request_start
+    stats = g.sql
+    endpoint = request.endpoint or 'unknown'
+
+    request_seconds.observe(endpoint, elapsed)
+    request_queries.observe(endpoint, stats['queries'])
+    request_db_seconds.observe(endpoint, stats['seconds'])
+
+    if elapsed * 1000 >= current_app.config['SLOW_REQUEST_THRESHOLD']:
+        slowest, statement = stats['slowest']
+        current_app.logger.warning(
+            'slow request %s %s: %.1f ms, %d queries, %.1f ms in db, '
+            'slowest %.1f ms: %s',
+            request.method,
+            request.full_path,
+            elapsed * 1000,
+            stats['queries'],
+            stats['seconds'] * 1000,
+            slowest * 1000,
+            ' '.join(statement.split()) if statement else '-'
+        )
+
+
+def cache_gauges() -> list:
+    caches = {
+        'follow_graph': follow_graph,
+        'user_loader': user_cache,
+        'post_fragments': post_fragments
+    }
+    lines = []
+
+    for metric in ('entries', 'hits', 'misses', 'evictions'):
+        name = 'microblog_cache_{}'.format(metric)
+        lines.append('# TYPE {} gauge'.format(name))
+        for cache, values in sorted(caches.items()):
+            lines.append('{}{{cache="{}"}} {}'.format(
+                name, cache, values.stats()[metric]
+            ))
+
+    for metric, value in sorted(hasher.stats().items()):
+        name = 'microblog_password_hasher_{}'.format(metric)
+        lines.append('# TYPE {} gauge'.format(name))
+        lines.append('{} {}'.format(name, value))
+
+    for metric, value in sorted(broker.stats().items()):
+        name = 'microblog_events_{}'.format(metric)
+        lines.append('# TYPE {} gauge'.format(name))
+        lines.append('{} {}'.format(name, value))
+
+    return lines
+
+
+@bp.route('/metrics')
+def metrics():
+    lines = []
+    for histogram in (request_seconds, request_queries, request_db_seconds):
+        lines.extend(histogram.exposition())
+    lines.extend(cache_gauges())
+
+    return Response(
+        '\n'.join(lines) + '\n',
+        mimetype='text/plain; version=0.0.4'
+    )
@@ -1,27 +1,181 @@
 from _md5 import md5
+from array import array
+from bisect import bisect_left
 from datetime import datetime
+from functools import lru_cache
 
+from flask import current_app
 from flask_login import UserMixin
-from werkzeug.security import check_password_hash
-from werkzeug.security import generate_password_hash
+from sqlalchemy.orm import make_transient_to_detached
 
 from app import db
 from app import login
+from app.cache import TTLCache
+from app.passwords import hasher
+from config import Config
 
 POST_LEN = 256
 
+# followed ids of each user, as sorted int arrays weighted by their size,
+# resized by create_app; the entries expire as the other workers' writes
+# can't invalidate them
+follow_graph = TTLCache(
+    Config.FOLLOW_CACHE_MAX_BYTES,
+    Config.FOLLOW_CACHE_TTL
+)
+
+
+# columns of the logged in user kept by the loader cache, the others
+# (counters, password hash) are loaded on first access
+CACHED_USER_FIELDS = (
+    'id',
+    'username',
+    'email',
+    'avatar_hash',
+    'about_me',
+    'last_seen',
+    'timeline_built'
+)
+
+user_cache = TTLCache(
+    Config.USER_CACHE_SIZE,
+    Config.USER_CACHE_TTL
+)
+
 
 @login.user_loader
 def load_user(usr_id: str):
-    return User.query.get(int(usr_id))
+    record = user_cache.get(int(usr_id))
 
+    if record is None:
+        usr = User.query.get(int(usr_id))
 
+        if usr is not None:
+            user_cache.set(usr.id, {
+                field: getattr(usr, field)
+                for field in CACHED_USER_FIELDS
+            })
+
+        return usr
+
+    # attach a persistent instance to the session without any SELECT
+    usr = User(**record)
+    make_transient_to_detached(usr)
+    return db.session.merge(usr, load=False)
+
+
+# the composite primary key serves the lookups by follower,
+# followed_id has its own index for the lookups by followed user
 followers = db.Table(
     'followers',
-    db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'))
+    db.Column(
+        'follower_id',
+        db.Integer,
+        db.ForeignKey('user.id'),
+        primary_key=True
+    ),
+    db.Column(
+        'followed_id',
+        db.Integer,
+        db.ForeignKey('user.id'),
+        primary_key=True,
+        index=True
+    )
 )
 
+# materialized home timeline, filled on write (see Post.fan_out)
+timeline = db.Table(
+    'timeline',
+    db.Column(
+        'user_id',
+        db.Integer,
+        db.ForeignKey('user.id'),
+        primary_key=True
+    ),
+    db.Column(
+        'post_id',
+        db.Integer,
+        db.ForeignKey('post.id'),
+        primary_key=True
+    ),
+    db.Column('timestamp', db.DateTime),
+    db.Index('ix_timeline_user_id_timestamp', 'user_id', 'timestamp')
+)
+
+# forward decayed hashtag counts shared by the workers, see app.trending
+trending_tags = db.Table(
+    'trending_tag',
+    db.Column('half_life', db.Integer, primary_key=True),
+    db.Column('tag', db.String(64), primary_key=True),
+    db.Column('period', db.Integer, nullable=False),
+    db.Column('score', db.Float, nullable=False),
+    db.Index(
+        'ix_trending_tag_half_life_period_score',
+        'half_life',
+        'period',
+        'score'
+    )
+)
+
+
+def email_digest(email: str) -> str:
+    return md5(
+        email
+            .lower()
+            .encode('utf-8')
+    ).hexdigest()
+
+
+@lru_cache(maxsize=4096)
+def gravatar_url(digest: str, size: int) -> str:
+    return 'https://www.gravatar.com/avatar/{}?d=identicon&s={}'.format(
+        digest,
+        size
+    )
+
+
+def timeline_enabled() -> bool:
+    return current_app.config.get('TIMELINE_ENABLED', False)
+
+
+def prune_timelines(owners) -> None:
+    """
+    keep only the TIMELINE_MAX_LEN newest entries of each given timeline
+
+    the cutoff of each timeline is looked up once through its index, then
+    only the entries older than it are deleted
+
+    :param owners: select of the ids of the owners of the timelines
+    """
+    owners = owners.subquery()
+    owner = list(owners.c)[0]
+    cutoff = db.select([timeline.c.timestamp]).where(
+        timeline.c.user_id == owner
+    ).order_by(
+        timeline.c.timestamp.desc()
+    ).limit(1).offset(
+        current_app.config['TIMELINE_MAX_LEN'] - 1
+    ).scalar_subquery()
+
+    full = [
+        {'owner': owner_id, 'cutoff': timestamp}
+        for owner_id, timestamp in db.session.execute(
+            db.select([owner, cutoff])
+        )
+        if timestamp is not None
+    ]
+    if not full:
+        return
+
+    db.session.execute(
+        timeline.delete().where(
+            timeline.c.user_id == db.bindparam('owner')
+        ).where(
+            timeline.c.timestamp < db.bindparam('cutoff')
+        ),
+        full
+    )
+
 
 class User(UserMixin, db.Model):
     id = db.Column(
@@ -43,6 +197,11 @@ class User(UserMixin, db.Model):
         unique=True
     )
 
+    # md5 of the lowercased email, used by gravatar
+    avatar_hash = db.Column(
+        db.String(32)
+    )
+
     # hashed user password
     password_hash = db.Column(
         db.String(128)
@@ -63,6 +222,36 @@ class User(UserMixin, db.Model):
         default=datetime.utcnow
     )
 
+    # denormalized counters, see reconcile_counters
+    followers_count = db.Column(
+        db.Integer,
+        default=0,
+        server_default='0',
+        nullable=False
+    )
+
+    followed_count = db.Column(
+        db.Integer,
+        default=0,
+        server_default='0',
+        nullable=False
+    )
+
+    posts_count = db.Column(
+        db.Integer,
+        default=0,
+        server_default='0',
+        nullable=False
+    )
+
+    # the timeline is maintained once rebuild_timeline filled it
+    timeline_built = db.Column(
+        db.Boolean,
+        default=False,
+        server_default=db.false(),
+        nullable=False
+    )
+
     # many to many relationship
     followed = db.relationship(
         'User',
@@ -80,45 +269,215 @@ class User(UserMixin, db.Model):
         lazy='dynamic'
     )
 
+    @db.validates('email')
+    def validate_email(self, key, email):
+        """
+        keeps the avatar digest in sync with the email
+        """
+        self.avatar_hash = email_digest(email) if email else None
+        return email
+
     def avatar(self, size):
-        digest = md5(
-            self.email
-                .lower()
-                .encode('utf-8')
-        ).hexdigest()
-        return 'https://www.gravatar.com/avatar/{}?d=identicon&s={}'.format(
-            digest,
-            size
-        )
+        digest = self.avatar_hash or email_digest(self.email)
+        return gravatar_url(digest, size)
 
     def set_password(self, password: str) -> None:
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
+        user_cache.pop(self.id)
 
     def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password_hash, password)
+        # users imported without a password can't log in
+        if self.password_hash is None:
+            return False
+
+        return hasher.verify(self.password_hash, password)
+
+    def upgrade_password(self, password: str) -> bool:
+        """
+        rehash a verified password whose hash uses outdated cost parameters
+
+        :return: True if the hash was replaced
+        """
+        if not hasher.needs_rehash(self.password_hash):
+            return False
+
+        self.set_password(password)
+        return True
+
+    def publish(self, body: str):
+        """
+        create a post authored by the user
+
+        :return: the new post
+        """
+        post = Post(body=body, author=self)
+        db.session.add(post)
+
+        # counters are incremented in SQL so concurrent writes don't race
+        self.posts_count = User.posts_count + 1
+        db.session.flush()
+        post.fan_out()
+
+        return post
 
     def follow(self, user):
-        if not self.is_following(user):
+        # the cached ids may be stale even when the row already exists
+        follow_graph.pop(self.id)
+
+        if not self.follows_in_db(user):
             self.followed.append(user)
+            self.followed_count = User.followed_count + 1
+            user.followers_count = User.followers_count + 1
+
+            if timeline_enabled() and self.timeline_built:
+                self.backfill_timeline(user)
 
     def unfollow(self, user):
-        if self.is_following(user):
+        follow_graph.pop(self.id)
+
+        if self.follows_in_db(user):
             self.followed.remove(user)
+            self.followed_count = User.followed_count - 1
+            user.followers_count = User.followers_count - 1
+
+            if timeline_enabled() and self.timeline_built:
+                self.purge_timeline(user)
 
     def followed_posts(self):
-        followed = Post.query.join(
-            followers,
-            (followers.c.followed_id == Post.user_id)
-        ).filter(
+        if timeline_enabled() and self.timeline_built:
+            return Post.query.join(
+                timeline,
+                (timeline.c.post_id == Post.id)
+            ).filter(
+                timeline.c.user_id == self.id
+            ).order_by(
+                timeline.c.timestamp.desc()
+            )
+
+        # a plain filter on post, so that the pagination's cursor, order and
+        # limit reach the (user_id, timestamp) index of each author
+        authors = db.union(
+            db.select([followers.c.followed_id]).where(
+                followers.c.follower_id == self.id
+            ),
+            db.select([db.literal(self.id)])
+        )
+        return Post.query.filter(
+            Post.user_id.in_(authors)
+        ).order_by(
+            Post.timestamp.desc()
+        )
+
+    def backfill_timeline(self, user) -> None:
+        """
+        copy the newest posts of a newly followed user into the timeline
+        """
+        db.session.flush()
+
+        present = db.select([timeline.c.post_id]).where(
+            timeline.c.user_id == self.id
+        )
+        posts = db.select([
+            db.literal(self.id),
+            Post.id,
+            Post.timestamp
+        ]).where(
+            Post.user_id == user.id
+        ).where(
+            Post.id.notin_(present)
+        ).order_by(
+            Post.timestamp.desc()
+        ).limit(
+            current_app.config['TIMELINE_MAX_LEN']
+        )
+
+        db.session.execute(
+            timeline.insert().from_select(
+                ['user_id', 'post_id', 'timestamp'],
+                posts
+            )
+        )
+        prune_timelines(db.select([db.literal(self.id)]))
+
+    def purge_timeline(self, user) -> None:
+        """
+        drop the posts of an unfollowed user from the timeline
+        """
+        db.session.execute(
+            timeline.delete().where(
+                timeline.c.user_id == self.id
+            ).where(
+                timeline.c.post_id.in_(
+                    db.select([Post.id]).where(Post.user_id == user.id)
+                )
+            )
+        )
+
+    def rebuild_timeline(self) -> None:
+        """
+        recompute the whole timeline from the follow graph, from then on
+        it is maintained by the writes
+        """
+        db.session.execute(
+            timeline.delete().where(timeline.c.user_id == self.id)
+        )
+
+        authors = db.select([followers.c.followed_id]).where(
             followers.c.follower_id == self.id
         )
-        own = Post.query.filter_by(
-            user_id=self.id
+        posts = db.select([
+            db.literal(self.id),
+            Post.id,
+            Post.timestamp
+        ]).where(
+            db.or_(
+                Post.user_id.in_(authors),
+                Post.user_id == self.id
+            )
+        ).order_by(
+            Post.timestamp.desc()
+        ).limit(
+            current_app.config['TIMELINE_MAX_LEN']
+        )
+
+        db.session.execute(
+            timeline.insert().from_select(
+                ['user_id', 'post_id', 'timestamp'],
+                posts
+            )
         )
-        return followed.union(own) \
-            .order_by(Post.timestamp.desc())
+        self.timeline_built = True
+        user_cache.pop(self.id)
+
+    def followed_ids(self) -> array:
+        """
+        :return: the sorted ids of the followed users, cached per process
+        """
+        ids = follow_graph.get(self.id)
+
+        if ids is None:
+            ids = array('q', (
+                followed_id for followed_id, in db.session.query(
+                    followers.c.followed_id
+                ).filter(
+                    followers.c.follower_id == self.id
+                ).order_by(
+                    followers.c.followed_id
+                )
+            ))
+            follow_graph.set(self.id, ids, ids.itemsize * len(ids) + 64)
+
+        return ids
 
     def is_following(self, user) -> bool:
+        ids = self.followed_ids()
+        index = bisect_left(ids, user.id)
+        return index < len(ids) and ids[index] == user.id
+
+    def follows_in_db(self, user) -> bool:
+        """
+        uncached is_following, for the writes to the follow graph
+        """
         return self.followed.filter(
             followers.c.followed_id == user.id
         ).count() > 0
@@ -127,11 +486,73 @@ class User(UserMixin, db.Model):
         return '<User {}>'.format(self.username)
 
 
+def reconcile_counters() -> None:
+    """
+    recompute the denormalized counters of every user in a single UPDATE
+    """
+    table = User.__table__
+
+    db.session.execute(
+        table.update().values(
+            followers_count=db.select([db.func.count()]).where(
+                followers.c.followed_id == table.c.id
+            ).scalar_subquery(),
+            followed_count=db.select([db.func.count()]).where(
+                followers.c.follower_id == table.c.id
+            ).scalar_subquery(),
+            posts_count=db.select([db.func.count(Post.id)]).where(
+                Post.user_id == table.c.id
+            ).scalar_subquery()
+        )
+    )
+
+
 class Post(db.Model):
+    __table_args__ = (
+        # per author feeds, newest first
+        db.Index('ix_post_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.String(140))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
+    def fan_out(self) -> None:
+        """
+        push the post into its author's and followers' timelines
+        """
+        if not timeline_enabled():
+            return
+
+        db.session.flush()
+
+        # the author and the followers whose timeline is built, the others
+        # read the feed query
+        recipients = db.select([User.id]).where(
+            User.timeline_built
+        ).where(
+            db.or_(
+                User.id == self.user_id,
+                User.id.in_(
+                    db.select([followers.c.follower_id]).where(
+                        followers.c.followed_id == self.user_id
+                    )
+                )
+            )
+        )
+        rows = recipients.add_columns(
+            db.literal(self.id),
+            db.literal(self.timestamp, db.DateTime)
+        )
+
+        db.session.execute(
+            timeline.insert().from_select(
+                ['user_id', 'post_id', 'timestamp'],
+                rows
+            )
+        )
+        prune_timelines(recipients)
+
     def __repr__(self):
         return '<Post {}>'.format(self.body)
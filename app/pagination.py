@@ -0,0 +1,107 @@
+from base64 import urlsafe_b64decode
+from base64 import urlsafe_b64encode
+from datetime import datetime
+
+from app import db
+from app.models import Post
+
+CURSOR_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(post: Post) -> str:
+    """
+    build an opaque token pointing at the given post
+    """
+    key = '{}|{}'.format(
+        post.timestamp.strftime(CURSOR_TIMESTAMP_FORMAT),
+        post.id
+    )
+    return urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token: str):
+    """
+    read back the (timestamp, id) key of a token
+
+    :return: the key, None if the token is missing or malformed
+    """
+    if not token:
+        return None
+
+    try:
+        timestamp, post_id = urlsafe_b64decode(
+            token.encode('ascii')
+        ).decode('utf-8').split('|')
+        return (
+            datetime.strptime(timestamp, CURSOR_TIMESTAMP_FORMAT),
+            int(post_id)
+        )
+    except (ValueError, UnicodeError):
+        return None
+
+
+class CursorPage:
+    """
+    page of a keyset paginated query, mirrors flask_sqlalchemy's Pagination
+    """
+
+    def __init__(self, items, has_next: bool, has_prev: bool):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.items[-1]) if self.items else None
+
+    @property
+    def prev_cursor(self):
+        return encode_cursor(self.items[0]) if self.items else None
+
+
+def keyset_paginate(query, per_page: int, after=None, before=None) -> CursorPage:
+    """
+    paginate a post query, newest first, on (timestamp, id)
+
+    unlike OFFSET pagination, each page is an index range scan starting at
+    the cursor so deep pages cost the same as the first one
+
+    :param query: post query, its ordering is replaced
+    :param per_page: number of posts per page
+    :param after: token of the last post of the previous (newer) page
+    :param before: token of the first post of the next (older) page
+    """
+    key = db.tuple_(Post.timestamp, Post.id)
+    query = query.order_by(None)
+
+    newer = decode_cursor(before)
+    if newer is not None:
+        items = query.filter(
+            key > db.tuple_(*newer)
+        ).order_by(
+            Post.timestamp.asc(),
+            Post.id.asc()
+        ).limit(per_page + 1).all()
+
+        has_prev = len(items) > per_page
+        items = items[:per_page]
+        items.reverse()
+
+        return CursorPage(items, has_next=True, has_prev=has_prev)
+
+    older = decode_cursor(after)
+    if older is not None:
+        query = query.filter(key < db.tuple_(*older))
+
+    items = query.order_by(
+        Post.timestamp.desc(),
+        Post.id.desc()
+    ).limit(per_page + 1).all()
+
+    has_next = len(items) > per_page
+
+    return CursorPage(
+        items[:per_page],
+        has_next=has_next,
+        has_prev=older is not None
+    )
@@ -0,0 +1,112 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.security import check_password_hash
+from werkzeug.security import generate_password_hash
+
+from config import Config
+
+
+class PasswordHasherBusy(Exception):
+    """
+    raised when the hashing queue is full
+    """
+    pass
+
+
+class PasswordHasher:
+    """
+    runs the password hashing on a bounded pool of worker threads
+
+    at most `workers` hashes are computed at once and `queue` more may
+    wait, beyond that requests are rejected instead of piling up; pbkdf2
+    releases the GIL so the other request threads keep running meanwhile
+    """
+
+    def __init__(self, workers: int, queue: int):
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._resize(workers, queue)
+
+    def _resize(self, workers: int, queue: int) -> None:
+        self.workers = workers
+        self.queue = queue
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix='password-hasher'
+        )
+
+    def init_app(self, app) -> None:
+        """
+        sizes the pool from PASSWORD_HASH_WORKERS and PASSWORD_HASH_QUEUE,
+        the worker threads are only started by the first hashes
+        """
+        workers = app.config['PASSWORD_HASH_WORKERS']
+        queue = app.config['PASSWORD_HASH_QUEUE']
+
+        if (workers, queue) != (self.workers, self.queue):
+            self._executor.shutdown(wait=False)
+            self._resize(workers, queue)
+
+    def run(self, func, *args):
+        """
+        runs func on the pool and waits for its result
+
+        :raise PasswordHasherBusy: if every worker and queue slot is taken
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy()
+
+        with self._lock:
+            self.submitted += 1
+
+        try:
+            return self._executor.submit(func, *args).result()
+        finally:
+            self._slots.release()
+            with self._lock:
+                self.completed += 1
+
+    def hash(self, password: str) -> str:
+        return self.run(
+            generate_password_hash,
+            password,
+            current_app.config['PASSWORD_HASH_METHOD']
+        )
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        return self.run(check_password_hash, pwhash, password)
+
+    @staticmethod
+    def needs_rehash(pwhash: str) -> bool:
+        """
+        :return: True if the hash was computed with other cost parameters
+            than PASSWORD_HASH_METHOD
+        """
+        method = pwhash.split('$', 1)[0]
+        return method != current_app.config['PASSWORD_HASH_METHOD']
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = self.submitted - self.completed
+
+        return {
+            'workers': self.workers,
+            'in_flight': min(pending, self.workers),
+            'queued': max(pending - self.workers, 0),
+            'completed': self.completed,
+            'rejected': self.rejected
+        }
+
+
+# resized by create_app
+hasher = PasswordHasher(
+    Config.PASSWORD_HASH_WORKERS,
+    Config.PASSWORD_HASH_QUEUE
+)
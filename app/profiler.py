@@ -0,0 +1,129 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+from time import time
+
+from itsdangerous import BadSignature
+from itsdangerous import TimestampSigner
+from werkzeug.exceptions import HTTPException
+
+TRIGGER_HEADER = 'HTTP_X_PROFILE'
+
+
+class SamplingProfiler:
+    """
+    WSGI middleware profiling a sample of the requests, or the ones
+    carrying a valid signed X-Profile header (see trigger_token)
+
+    each profile is dumped under PROFILER_DIR/<endpoint>/ and only the
+    PROFILER_RETENTION most recent dumps of an endpoint are kept; only
+    the call of the application is profiled, not the iteration over a
+    streamed body
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def signer(self) -> TimestampSigner:
+        return TimestampSigner(self.app.config['SECRET_KEY'], salt='profiler')
+
+    def trigger_token(self) -> str:
+        return self.signer().sign(b'profile').decode('ascii')
+
+    def _triggered(self, environ) -> bool:
+        token = environ.get(TRIGGER_HEADER)
+        if not token:
+            return False
+
+        try:
+            self.signer().unsign(
+                token,
+                max_age=self.app.config['PROFILER_TRIGGER_MAX_AGE']
+            )
+        except BadSignature:
+            return False
+
+        return True
+
+    def _endpoint(self, environ) -> str:
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return 'unknown'
+        return endpoint
+
+    def __call__(self, environ, start_response):
+        sampled = random.random() < self.app.config['PROFILER_SAMPLE_RATE']
+        if not sampled and not self._triggered(environ):
+            return self.wsgi_app(environ, start_response)
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another request of the process is being profiled
+            return self.wsgi_app(environ, start_response)
+
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            profile.disable()
+            self._dump(self._endpoint(environ), profile)
+
+    def _dump(self, endpoint: str, profile: cProfile.Profile) -> None:
+        directory = os.path.join(self.app.config['PROFILER_DIR'], endpoint)
+        os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            self._sequence += 1
+            name = '{:.0f}-{}-{}.prof'.format(
+                time() * 1000, os.getpid(), self._sequence
+            )
+
+        profile.dump_stats(os.path.join(directory, name))
+
+        dumps = dump_files(directory)
+        for stale in dumps[:-self.app.config['PROFILER_RETENTION']]:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+
+def dump_files(directory: str) -> list:
+    """
+    :return: the dumps of an endpoint directory, oldest first
+    """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+
+    return sorted(
+        (os.path.join(directory, name) for name in names
+         if name.endswith('.prof')),
+        key=lambda path: int(os.path.basename(path).split('-')[0])
+    )
+
+
+def hot_functions(directory: str, top: int = 20, sort: str = 'cumulative'):
+    """
+    aggregates every dump of an endpoint directory
+
+    :return: the pstats report of the top functions, None without dumps
+    """
+    dumps = dump_files(directory)
+    if not dumps:
+        return None
+
+    output = io.StringIO()
+    stats = pstats.Stats(*dumps, stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+
+    return '{} profiled requests\n{}'.format(len(dumps), output.getvalue())
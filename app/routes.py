@@ -1,221 +1,169 @@
-from datetime import datetime
+import unicodedata
+from time import time
+from zlib import crc32
 
+from flask import Blueprint
+from flask import Response
+from flask import current_app
 from flask import render_template
 from flask import request
 from flask import flash
+from flask import jsonify
 from flask import redirect
 from flask import url_for
+from flask import abort
+from flask import stream_with_context
 
 from flask_login import current_user
-from flask_login import login_user
-from flask_login import logout_user
 from flask_login import login_required
 
-from app import app, db
-from app.forms import LoginForm
-from app.forms import RegistrationForm
+from sqlalchemy.exc import IntegrityError
+from werkzeug.urls import url_quote
+
+from app import db
+from app.database import use_primary
 from app.forms import EditProfileForm
 from app.forms import PostForm
+from app.etags import feed_etag
+from app.etags import newest_post_id
+from app.etags import not_modified
+from app.etags import tagged
+from app.events import broker
+from app.events import post_event
+from app.export import EXPORTS
+from app.export import FORMATS
+from app.export import export_rows
+from app.last_seen import last_seen
 from app.models import User, Post
+from app.models import user_cache
+from app.pagination import keyset_paginate
+from app.search import search_posts
+from app.trending import trending
+
+bp = Blueprint('main', __name__)
+
+# authors of a feed page are loaded in one query, then served from the
+# session identity map for the rest of the request
+with_authors = db.selectinload('author')
 
 
-@app.before_request
+@bp.before_app_request
 def before_request():
     """
-    updates the 'last seen' field
+    updates the 'last seen' field, written behind in batches
     """
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
-
-
-# noinspection PyUnusedLocal
-@app.errorhandler(404)
-def not_found_error(error):
-    return render_template('404.html'), 404
+        last_seen.touch(current_user)
 
 
-# noinspection PyUnusedLocal
-@app.errorhandler(500)
-def internal_error(error):
-    db.session.rollback()
-    return render_template('500.html'), 500
-
-
-@app.route('/', methods=['GET', 'POST'])
-@app.route('/index', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
+@bp.route('/index', methods=['GET', 'POST'])
 @login_required
 def index():
     form = PostForm()
 
     if form.validate_on_submit():
-        post = Post(
-            body=form.post.data,
-            author=current_user
-        )
-
-        db.session.add(post)
+        post = current_user.publish(form.post.data)
         db.session.commit()
+        trending.record(post.body)
+        broker.publish(post.user_id, post_event(post))
 
         flash('Your post is now live!')
 
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
-    posts = current_user.followed_posts().all()
-
-    return render_template(
-        'index.html',
-        title='Home page',
-        form=form,
-        posts=posts
+    # the form's csrf token expires, so does the cached page
+    token_lifetime = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600) or 0
+    etag = feed_etag(
+        newest_post_id(),
+        crc32(current_user.followed_ids().tobytes()),
+        int(time() // (token_lifetime // 2)) if token_lifetime else None
     )
 
+    if request.method == 'GET':
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
 
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    # a user already authenticated is redirected to homepage
-    if current_user.is_authenticated:
-        return redirect(url_for('index'))
-
-    form = LoginForm()
-
-    # redirection on the same page if form invalid
-    if not form.validate_on_submit():
-        return render_template(
-            'login.html',
-            title='Sign In',
-            form=form
-        )
-
-    # query the user
-    usr = User.query.filter_by(
-        username=form.username.data
-    ).first()
-
-    # if credential doesn't match any user, redirect on login
-    if usr is None \
-            or not usr.check_password(form.password.data):
-        flash('Invalid username or password')
-        return redirect(url_for('login'))
-
-    # load the requested user
-    login_user(
-        usr,
-        remember=form.remember_me.data
-    )
-
-    # redirect on previous page or on homepage
-    page = request.args.get(
-        'page',
-        1,
-        type=int
-    )
-
-    posts = current_user.followed_posts().paginate(
-        page,
-        app.config['POSTS_PER_PAGE'],
-        False
+    posts = keyset_paginate(
+        current_user.followed_posts().options(with_authors),
+        current_app.config['POSTS_PER_PAGE'],
+        after=request.args.get('after'),
+        before=request.args.get('before')
     )
 
     next_url = url_for(
-        'index',
-        page=posts.next_num
+        'main.index',
+        after=posts.next_cursor
     ) if posts.has_next else None
 
     prev_url = url_for(
-        'index',
-        page=posts.prev_num
+        'main.index',
+        before=posts.prev_cursor
     ) if posts.has_prev else None
 
-    # user redirected to home page
-    return render_template(
+    return tagged(render_template(
         'index.html',
-        title='Home',
+        title='Home page',
+        form=form,
         posts=posts.items,
         next_url=next_url,
         prev_url=prev_url
-    )
-
-
-@app.route('/logout')
-def logout():
-    logout_user()
-    return redirect(url_for('index'))
-
-
-# noinspection PyArgumentList
-@app.route('/register', methods=['GET', 'POST'])
-def register():
-    # redirect logged in users to home page
-    if current_user.is_authenticated:
-        return redirect(url_for('index'))
-
-    form = RegistrationForm()
-    if not form.validate_on_submit():
-        return render_template(
-            'register.html',
-            title='Register',
-            form=form
-        )
-    usr = User(
-        username=form.username.data,
-        email=form.email.data
-    )
-    usr.set_password(
-        form.password.data
-    )
-
-    db.session.add(usr)
-    db.session.commit()
-
-    flash('registered successfully !')
+    ), etag)
 
-    return redirect(url_for('login'))
 
-
-@app.route('/user/<username>')
+@bp.route('/user/<username>')
 @login_required
 def user(username):
     usr = User.query.filter_by(
         username=username
     ).first_or_404()
 
-    page = request.args.get(
-        'page',
-        1,
-        type=int
+    etag = feed_etag(
+        usr.id,
+        usr.username,
+        usr.avatar_hash,
+        usr.about_me,
+        usr.last_seen,
+        usr.posts_count,
+        usr.followers_count,
+        usr.followed_count,
+        current_user.is_following(usr)
     )
 
-    posts = usr.posts.order_by(
-        Post.timestamp.desc()
-    ).paginate(
-        page,
-        app.config['POSTS_PER_PAGE'],
-        False
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    posts = keyset_paginate(
+        usr.posts.options(with_authors),
+        current_app.config['POSTS_PER_PAGE'],
+        after=request.args.get('after'),
+        before=request.args.get('before')
     )
 
     next_url = url_for(
-        'user',
+        'main.user',
         username=usr.username,
-        page=posts.next_num
+        after=posts.next_cursor
     ) if posts.has_next else None
 
     prev_url = url_for(
-        'user',
+        'main.user',
         username=usr.username,
-        page=posts.prev_num
+        before=posts.prev_cursor
     ) if posts.has_prev else None
 
-    return render_template(
+    return tagged(render_template(
         'user.html',
         user=usr,
         posts=posts.items,
         next_url=next_url,
         prev_url=prev_url
-    )
+    ), etag)
 
 
-@app.route('/edit_profile', methods=['GET', 'POST'])
+@bp.route('/edit_profile', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
     form = EditProfileForm(current_user.username)
@@ -223,11 +171,19 @@ def edit_profile():
     if form.validate_on_submit():
         current_user.username = form.username.data
         current_user.about_me = form.about_me.data
-        db.session.commit()
+
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('Please use a different username.')
+            return redirect(url_for('main.edit_profile'))
+
+        user_cache.pop(current_user.id)
 
         flash('Your changes have been saved.')
 
-        return redirect(url_for('edit_profile'))
+        return redirect(url_for('main.edit_profile'))
 
     elif request.method == 'GET':
         form.username.data = current_user.username
@@ -240,8 +196,9 @@ def edit_profile():
     )
 
 
-@app.route('/follow/<username>')
+@bp.route('/follow/<username>')
 @login_required
+@use_primary
 def follow(username: str):
     usr = User.query.filter_by(
         username=username
@@ -249,22 +206,23 @@ def follow(username: str):
 
     if usr is None:
         flash('User {} not found.'.format(username))
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     if usr == current_user:
         flash('You cannot follow yourself !')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     current_user.follow(usr)
     db.session.commit()
 
     flash('You are following {}!'.format(username))
 
-    return redirect(url_for('user', username=username))
+    return redirect(url_for('main.user', username=username))
 
 
-@app.route('/unfollow/<username>')
+@bp.route('/unfollow/<username>')
 @login_required
+@use_primary
 def unfollow(username):
     usr = User.query.filter_by(
         username=username
@@ -272,12 +230,12 @@ def unfollow(username):
 
     if usr is None:
         flash('User {} not found.'.format(username))
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     if usr == current_user:
         flash('You cannot unfollow yourself!')
         return redirect(url_for(
-            'user',
+            'main.user',
             username=username
         ))
 
@@ -286,40 +244,170 @@ def unfollow(username):
 
     flash('You are not following {}.'.format(username))
 
-    return redirect(url_for('user', username=username))
+    return redirect(url_for('main.user', username=username))
 
 
-@app.route('/explore')
+@bp.route('/explore')
 @login_required
 def explore():
-    page = request.args.get(
-        'page',
-        1,
-        type=int
-    )
+    etag = feed_etag(newest_post_id())
 
-    posts = Post.query.order_by(
-        Post.timestamp.desc()
-    ).paginate(
-        page,
-        app.config['POSTS_PER_PAGE'],
-        False
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    posts = keyset_paginate(
+        Post.query.options(with_authors),
+        current_app.config['POSTS_PER_PAGE'],
+        after=request.args.get('after'),
+        before=request.args.get('before')
     )
 
     next_url = url_for(
-        'explore',
-        page=posts.next_num
+        'main.explore',
+        after=posts.next_cursor
     ) if posts.has_next else None
 
     prev_url = url_for(
-        'explore',
-        page=posts.prev_num
+        'main.explore',
+        before=posts.prev_cursor
     ) if posts.has_prev else None
 
-    return render_template(
+    return tagged(render_template(
         "index.html",
         title='Explore',
         posts=posts.items,
+        trends=trending.top(),
         next_url=next_url,
         prev_url=prev_url
+    ), etag)
+
+
+@bp.route('/events')
+@login_required
+def events():
+    """
+    server-sent events of the new posts of the followed users and of the
+    user, e.g. new EventSource('/events')
+    """
+    if not current_app.config['EVENTS_ENABLED']:
+        abort(404)
+
+    topics = set(current_user.followed_ids())
+    topics.add(current_user.id)
+    subscriber = broker.subscribe(topics)
+
+    # the stream runs after the request context, and its session, is gone
+    response = Response(
+        broker.stream(subscriber, current_app.config['EVENTS_KEEPALIVE']),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # also when the stream is never read, e.g. HEAD or an early disconnect
+    response.call_on_close(lambda: broker.unsubscribe(subscriber))
+
+    return response
+
+
+@bp.route('/export/<kind>')
+@login_required
+def export(kind):
+    """
+    download of the user's posts, followers or followed users, e.g.
+    /export/posts?format=csv&gzip=1
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if kind not in EXPORTS or fmt not in FORMATS:
+        abort(404)
+
+    compress = request.args.get('gzip') == '1'
+    filename = '{}-{}.{}{}'.format(
+        current_user.username,
+        kind,
+        fmt,
+        '.gz' if compress else ''
+    )
+
+    # the rows are read while streaming, within the request's session
+    response = Response(
+        stream_with_context(
+            export_rows(kind, current_user.id, fmt, compress)
+        ),
+        mimetype='application/gzip' if compress else FORMATS[fmt][1]
+    )
+    response.headers.set(
+        'Content-Disposition',
+        'attachment',
+        **attachment_names(filename)
+    )
+
+    return response
+
+
+def attachment_names(filename: str) -> dict:
+    """
+    :return: the Content-Disposition parameters of a download, a non ascii
+        filename is sent encoded with an ascii fallback
+    """
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename)
+        return {
+            'filename': simple.encode('ascii', 'ignore').decode('ascii'),
+            'filename*': "UTF-8''" + url_quote(filename, safe='')
+        }
+
+    return {'filename': filename}
+
+
+@bp.route('/search')
+@login_required
+def search():
+    text = request.args.get('q', '')
+    posts = search_posts(
+        text,
+        current_app.config['POSTS_PER_PAGE'],
+        after=request.args.get('after')
+    )
+
+    next_url = url_for(
+        'main.search',
+        q=text,
+        after=posts.next_cursor
+    ) if posts.has_next else None
+
+    return render_template(
+        'search.html',
+        title='Search',
+        query=text,
+        posts=posts.items,
+        next_url=next_url
     )
+
+
+@bp.route('/api/search')
+@login_required
+def search_api():
+    """
+    e.g. /api/search?q=flask, the next page is at ?q=flask&after=<next>
+    """
+    posts = search_posts(
+        request.args.get('q', ''),
+        current_app.config['POSTS_PER_PAGE'],
+        after=request.args.get('after')
+    )
+
+    return jsonify({
+        'posts': [
+            {
+                'id': post.id,
+                'author': post.author.username,
+                'body': post.body,
+                'timestamp': post.timestamp.isoformat() + 'Z',
+                'rank': rank
+            }
+            for post, rank in zip(posts.items, posts.ranks)
+        ],
+        'next': posts.next_cursor if posts.has_next else None
+    })
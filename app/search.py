@@ -0,0 +1,205 @@
+import re
+from base64 import urlsafe_b64decode
+from base64 import urlsafe_b64encode
+
+from flask import current_app
+from sqlalchemy import DDL
+from sqlalchemy import event
+
+from app import db
+from app.models import Post
+
+# words of a search, a trailing * makes a prefix search
+SEARCH_TERM = re.compile(r'(\w+)(\*?)')
+
+# external content index of post.body: only the terms are stored, the
+# rowid is the post id
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE IF NOT EXISTS post_search USING fts5(
+    body,
+    content='post',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+)
+"""
+
+# the index follows every write of post, bulk imports included
+CREATE_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS post_search_insert AFTER INSERT ON post
+    BEGIN
+        INSERT INTO post_search (rowid, body) VALUES (new.id, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS post_search_delete AFTER DELETE ON post
+    BEGIN
+        INSERT INTO post_search (post_search, rowid, body)
+        VALUES ('delete', old.id, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS post_search_update AFTER UPDATE OF body
+    ON post
+    BEGIN
+        INSERT INTO post_search (post_search, rowid, body)
+        VALUES ('delete', old.id, old.body);
+        INSERT INTO post_search (rowid, body) VALUES (new.id, new.body);
+    END
+    """
+)
+
+TRIGGERS = ('post_search_insert', 'post_search_delete', 'post_search_update')
+
+# rank is bm25(), lower is more relevant
+post_search = db.table(
+    'post_search',
+    db.column('rowid'),
+    db.column('rank')
+)
+
+for statement in (CREATE_INDEX,) + CREATE_TRIGGERS:
+    event.listen(
+        Post.__table__,
+        'after_create',
+        DDL(statement).execute_if(dialect='sqlite')
+    )
+
+event.listen(
+    Post.__table__,
+    'before_drop',
+    DDL('DROP TABLE IF EXISTS post_search').execute_if(dialect='sqlite')
+)
+
+
+def create_triggers(connection) -> None:
+    for statement in CREATE_TRIGGERS:
+        connection.exec_driver_sql(statement)
+
+
+def drop_triggers(connection) -> None:
+    for trigger in TRIGGERS:
+        connection.exec_driver_sql('DROP TRIGGER IF EXISTS ' + trigger)
+
+
+def rebuild_index(connection) -> None:
+    """
+    creates the index if needed and fills it from the post table
+    """
+    connection.exec_driver_sql(CREATE_INDEX)
+    create_triggers(connection)
+    connection.exec_driver_sql(
+        "INSERT INTO post_search (post_search) VALUES ('rebuild')"
+    )
+    connection.exec_driver_sql(
+        "INSERT INTO post_search (post_search) VALUES ('optimize')"
+    )
+
+
+def match_expression(text: str):
+    """
+    FTS5 query matching the posts containing every word of text, words are
+    quoted so that the FTS5 operators are searched as plain words
+
+    :return: the query, None if text has no word
+    """
+    terms = [
+        '"{}"{}'.format(word, prefix)
+        for word, prefix in SEARCH_TERM.findall(text or '')
+    ]
+    return ' '.join(terms) or None
+
+
+def encode_cursor(rank: float, post_id: int) -> str:
+    key = '{!r}|{}'.format(rank, post_id)
+    return urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token: str):
+    """
+    :return: the (rank, post id) key of a token, None if it is missing or
+        malformed
+    """
+    if not token:
+        return None
+
+    try:
+        rank, post_id = urlsafe_b64decode(
+            token.encode('ascii')
+        ).decode('utf-8').split('|')
+        return float(rank), int(post_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+class SearchPage:
+    """
+    page of ranked posts, the rank of each post is in ranks
+    """
+
+    def __init__(self, items, ranks, has_next: bool):
+        self.items = items
+        self.ranks = ranks
+        self.has_next = has_next
+
+    @property
+    def next_cursor(self):
+        if not self.items:
+            return None
+        return encode_cursor(self.ranks[-1], self.items[-1].id)
+
+
+def search_posts(text: str, per_page: int, after=None,
+                 candidates: int = None) -> SearchPage:
+    """
+    posts matching text, most relevant first then newest first
+
+    only the newest `candidates` matches are ranked, defaults to
+    SEARCH_MAX_CANDIDATES, so that a common word does not rank the whole
+    table on each page
+
+    pages follow each other on (rank, id); ranks depend on the whole
+    index so posts published in between may shift the next pages
+
+    :param after: token of the last post of the previous page
+    """
+    expression = match_expression(text)
+    if expression is None:
+        return SearchPage([], [], has_next=False)
+
+    if candidates is None:
+        candidates = current_app.config['SEARCH_MAX_CANDIDATES']
+
+    # FTS5 walks the matches by descending rowid and computes the rank of
+    # the rows kept only
+    matches = db.select([post_search.c.rowid, post_search.c.rank]).where(
+        db.literal_column('post_search').op('MATCH')(expression)
+    ).order_by(
+        post_search.c.rowid.desc()
+    ).limit(candidates).subquery()
+
+    query = db.session.query(Post, matches.c.rank).join(
+        matches,
+        matches.c.rowid == Post.id
+    ).options(
+        db.selectinload(Post.author)
+    )
+
+    last = decode_cursor(after)
+    if last is not None:
+        rank, post_id = last
+        query = query.filter(db.or_(
+            matches.c.rank > rank,
+            db.and_(matches.c.rank == rank, Post.id < post_id)
+        ))
+
+    rows = query.order_by(
+        matches.c.rank,
+        Post.id.desc()
+    ).limit(per_page + 1).all()
+
+    return SearchPage(
+        [post for post, _ in rows[:per_page]],
+        [rank for _, rank in rows[:per_page]],
+        has_next=len(rows) > per_page
+    )
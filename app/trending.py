@@ -0,0 +1,342 @@
+import atexit
+import heapq
+import re
+import threading
+from collections import defaultdict
+from operator import itemgetter
+from time import monotonic
+from time import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.models import trending_tags
+
+HASHTAG = re.compile(r'(?<![\w#])#(\w{1,64})')
+
+# the landmark of the weights moves every PERIOD half-lives so that they
+# stay below 2 ** PERIOD
+PERIOD = 256
+
+
+def extract_hashtags(body: str) -> set:
+    """
+    :return: the lowercased hashtags of a post body, without the #
+    """
+    return {tag.lower() for tag in HASHTAG.findall(body or '')}
+
+
+class DecayedTopK:
+    """
+    hashtag counts of one window, halved every half_life seconds, and the
+    k highest of them in a min-heap
+
+    the counts are forward decayed: a use at time t weighs
+    2 ** ((t - landmark) / half_life), so they never need to be decayed
+    in place and their order does not change with time, only once per
+    PERIOD half-lives when the landmark moves
+    """
+
+    def __init__(self, half_life: int, k: int, capacity: int):
+        self.half_life = half_life
+        self.k = k
+        self.capacity = capacity
+        self.period = None
+        self.scores = {}
+        # weights added since the last flush
+        self.pending = defaultdict(float)
+        self._top = {}
+        self._heap = []
+
+    def landmark(self) -> float:
+        return self.period * self.half_life * PERIOD
+
+    def weight(self, seen: float) -> float:
+        return 2.0 ** ((seen - self.landmark()) / self.half_life)
+
+    def count(self, score: float, now: float) -> float:
+        """
+        :return: the decayed count of a score at time now
+        """
+        return score * 2.0 ** ((self.landmark() - now) / self.half_life)
+
+    def roll(self, now: float) -> None:
+        """
+        moves the landmark to the period of now, scaling the scores down
+        """
+        period = int(now // (self.half_life * PERIOD))
+        if self.period is None:
+            self.period = period
+            return
+        if period <= self.period:
+            return
+
+        factor = 2.0 ** (-PERIOD * (period - self.period))
+        self.period = period
+        self.scores = {
+            tag: score * factor
+            for tag, score in self.scores.items()
+        }
+        for tag in self.pending:
+            self.pending[tag] *= factor
+        self._rank()
+
+    def add(self, tag: str, weight: float) -> None:
+        score = self.scores.get(tag, 0.0) + weight
+        self.scores[tag] = score
+        self.pending[tag] += weight
+
+        if tag in self._top:
+            self._top[tag] = score
+            self._heap = [(value, key) for key, value in self._top.items()]
+            heapq.heapify(self._heap)
+        elif len(self._top) < self.k:
+            self._top[tag] = score
+            heapq.heappush(self._heap, (score, tag))
+        elif score > self._heap[0][0]:
+            _, evicted = heapq.heapreplace(self._heap, (score, tag))
+            del self._top[evicted]
+            self._top[tag] = score
+
+        # the least used half is forgotten, the top is among the rest
+        if len(self.scores) > self.capacity:
+            self.scores = dict(heapq.nlargest(
+                max(self.capacity // 2, self.k),
+                self.scores.items(),
+                key=itemgetter(1)
+            ))
+
+    def merge(self, rows) -> None:
+        """
+        takes the (tag, period, score) rows stored by every worker, plus
+        the weights added here since they were written
+        """
+        for tag, period, score in rows:
+            factor = 2.0 ** (-PERIOD * (self.period - period))
+            self.scores[tag] = score * factor + self.pending.get(tag, 0.0)
+        self._rank()
+
+    def _rank(self) -> None:
+        self._top = dict(heapq.nlargest(
+            self.k,
+            self.scores.items(),
+            key=itemgetter(1)
+        ))
+        self._heap = [(value, key) for key, value in self._top.items()]
+        heapq.heapify(self._heap)
+
+    def top(self, now: float) -> list:
+        """
+        :return: the (hashtag, decayed count) pairs, most used first
+        """
+        return [
+            (tag, self.count(score, now))
+            for tag, score in sorted(
+                self._top.items(),
+                key=itemgetter(1),
+                reverse=True
+            )
+        ]
+
+
+class Trending:
+    """
+    hashtags most used by the recent posts, per window of TRENDING_WINDOWS
+
+    the counts are kept in memory and added to the trending_tag table
+    every TRENDING_FLUSH_INTERVAL seconds, when the top of each window is
+    read back with the counts of the other workers; reading the top never
+    queries the post table, and a failed flush is logged and retried later
+    """
+
+    def __init__(self):
+        self.app = None
+        self.windows = {}
+        self._lock = threading.Lock()
+        self._last_flush = None
+
+    def init_app(self, app) -> None:
+        """
+        the counts are written to the database of app, also when the
+        process exits
+        """
+        if self.app is None:
+            atexit.register(self.flush_pending)
+
+        self.app = app
+        self.windows = {
+            name: DecayedTopK(
+                half_life,
+                app.config['TRENDING_TOP_K'],
+                app.config['TRENDING_CAPACITY']
+            )
+            for name, half_life in app.config['TRENDING_WINDOWS'].items()
+        }
+        self._last_flush = None
+
+    def record(self, body: str, seen: float = None) -> set:
+        """
+        count the hashtags of a new post
+
+        :return: the hashtags found
+        """
+        tags = extract_hashtags(body)
+        if not tags:
+            return tags
+
+        now = time()
+        with self._lock:
+            for decayed in self.windows.values():
+                decayed.roll(now)
+                weight = decayed.weight(seen or now)
+                for tag in tags:
+                    decayed.add(tag, weight)
+
+        if self._due():
+            self._try_flush()
+
+        return tags
+
+    def top(self, window: str = None) -> list:
+        """
+        :param window: one of TRENDING_WINDOWS, defaults to the first one
+        :return: the (hashtag, decayed count) pairs, most used first
+        """
+        if self._due():
+            self._try_flush()
+
+        now = time()
+        with self._lock:
+            decayed = self.windows[window or next(iter(self.windows))]
+            decayed.roll(now)
+            return decayed.top(now)
+
+    def _due(self) -> bool:
+        return self._last_flush is None or monotonic() - self._last_flush \
+            >= self.app.config['TRENDING_FLUSH_INTERVAL']
+
+    def _try_flush(self) -> None:
+        """
+        flush on the request path, where the post is already saved
+        """
+        try:
+            self.flush()
+        except SQLAlchemyError:
+            self.app.logger.exception('trending flush failed')
+
+    def flush_pending(self) -> int:
+        if not any(decayed.pending for decayed in self.windows.values()):
+            return 0
+        return self.flush()
+
+    def flush(self) -> int:
+        """
+        add the pending counts to the database and read back the top of
+        each window
+
+        :return: the number of counts written
+        """
+        if self.app is None:
+            return 0
+
+        now = time()
+        with self._lock:
+            self._last_flush = monotonic()
+            batches = []
+            for decayed in self.windows.values():
+                decayed.roll(now)
+                batches.append((decayed, decayed.period, decayed.pending))
+                decayed.pending = defaultdict(float)
+
+        table = trending_tags
+        written = 0
+        results = []
+
+        try:
+            with db.get_engine(self.app).begin() as connection:
+                for decayed, period, pending in batches:
+                    half_life = decayed.half_life
+
+                    if pending:
+                        present = {
+                            tag for tag, in connection.execute(
+                                db.select([table.c.tag]).where(
+                                    table.c.half_life == half_life
+                                ).where(
+                                    table.c.tag.in_(list(pending))
+                                )
+                            )
+                        }
+                        missing = [
+                            tag for tag in pending if tag not in present
+                        ]
+                        if missing:
+                            connection.execute(table.insert(), [
+                                {'half_life': half_life, 'tag': tag,
+                                 'period': period, 'score': 0.0}
+                                for tag in missing
+                            ])
+
+                        # a row of the previous period is scaled to this one
+                        connection.execute(
+                            table.update().where(
+                                table.c.half_life == half_life
+                            ).where(
+                                table.c.tag == db.bindparam('key')
+                            ).values(
+                                period=period,
+                                score=db.case(
+                                    (table.c.period == period, table.c.score),
+                                    (table.c.period == period - 1,
+                                     table.c.score * 2.0 ** -PERIOD),
+                                    else_=0.0
+                                ) + db.bindparam('weight')
+                            ),
+                            [
+                                {'key': tag, 'weight': weight}
+                                for tag, weight in pending.items()
+                            ]
+                        )
+                        written += len(pending)
+
+                    connection.execute(
+                        table.delete().where(
+                            table.c.half_life == half_life
+                        ).where(
+                            table.c.period < period - 1
+                        )
+                    )
+
+                    rows = []
+                    for current in (period, period - 1):
+                        rows.extend(connection.execute(
+                            db.select([
+                                table.c.tag,
+                                table.c.period,
+                                table.c.score
+                            ]).where(
+                                table.c.half_life == half_life
+                            ).where(
+                                table.c.period == current
+                            ).order_by(
+                                table.c.score.desc()
+                            ).limit(decayed.k)
+                        ).fetchall())
+                    results.append((decayed, rows))
+        except SQLAlchemyError:
+            # the counts are kept for the next flush
+            with self._lock:
+                for decayed, period, pending in batches:
+                    factor = 2.0 ** (-PERIOD * (decayed.period - period))
+                    for tag, weight in pending.items():
+                        decayed.pending[tag] += weight * factor
+            raise
+
+        with self._lock:
+            for decayed, rows in results:
+                decayed.merge(rows)
+
+        return written
+
+
+trending = Trending()
@@ -0,0 +1,219 @@
+"""
+read throughput and latency while posts are being written, with SQLite's
+defaults and with the performance profile of the configuration (WAL,
+pragmas, pooled connections)
+
+    python -m benchmarks.concurrency --readers 4 --writers 1 --seconds 10
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+from time import perf_counter
+from time import sleep
+
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+
+from app import create_app, db
+from app.models import User, Post
+from app.pagination import keyset_paginate
+from app.routes import with_authors
+from benchmarks.generator import Generator, load
+from benchmarks.routes import git_revision, percentile
+from config import Config
+
+# settings of each profile, over the ones of Config
+PROFILES = {
+    'defaults': {
+        'DATABASE_POOL_SIZE': 0,
+        'SQLITE_JOURNAL_MODE': 'DELETE',
+        'SQLITE_SYNCHRONOUS': 'FULL',
+        'SQLITE_MMAP_SIZE': 0,
+        'SQLITE_CACHE_SIZE': -2000,
+        'SQLITE_TEMP_STORE': 'DEFAULT'
+    },
+    'tuned': {}
+}
+
+
+class BenchmarkConfig(Config):
+    # each profile builds its own app, without log handlers
+    TESTING = True
+
+
+def read_page(rng: random.Random, user_ids: list) -> None:
+    """
+    first page of the explore feed or of a profile
+    """
+    query = Post.query
+    if rng.random() < 0.5:
+        query = query.filter_by(user_id=rng.choice(user_ids))
+
+    keyset_paginate(
+        query.options(with_authors),
+        current_app.config['POSTS_PER_PAGE']
+    )
+
+
+def write_post(rng: random.Random, user_ids: list) -> None:
+    User.query.get(rng.choice(user_ids)).publish(
+        'benchmark post {}'.format(rng.random())
+    )
+    db.session.commit()
+
+
+def worker(app, operation, user_ids: list, seed: int,
+           stop: threading.Event, latencies: list, errors: list) -> None:
+    """
+    runs operation in a loop, each iteration with its own session like a
+    request
+    """
+    rng = random.Random(seed)
+
+    with app.app_context():
+        while not stop.is_set():
+            start = perf_counter()
+            try:
+                operation(rng, user_ids)
+            except OperationalError:
+                db.session.rollback()
+                errors.append(perf_counter() - start)
+            else:
+                latencies.append((perf_counter() - start) * 1000)
+            finally:
+                db.session.remove()
+
+
+def summary(latencies: list, errors: int, seconds: float) -> dict:
+    if not latencies:
+        return {'per_second': 0, 'p50_ms': None, 'p99_ms': None,
+                'errors': errors}
+
+    return {
+        'per_second': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'errors': errors
+    }
+
+
+def profile_config(profile: str, path: str) -> type:
+    """
+    :return: the configuration of a profile on the database at path, the
+        app opens it when created
+    """
+    return type(
+        'ProfileConfig',
+        (BenchmarkConfig,),
+        dict(PROFILES[profile], SQLALCHEMY_DATABASE_URI='sqlite:///' + path)
+    )
+
+
+def run_profile(profile: str, path: str, args) -> dict:
+    app = create_app(profile_config(profile, path))
+
+    with app.app_context():
+        user_ids = [usr_id for usr_id, in db.session.query(User.id)]
+        db.session.remove()
+
+    stop = threading.Event()
+    roles = [('read', read_page)] * args.readers \
+        + [('write', write_post)] * args.writers
+    results = [(role, [], []) for role, _ in roles]
+    threads = [
+        threading.Thread(
+            target=worker,
+            args=(app, operation, user_ids, args.seed + i, stop,
+                  results[i][1], results[i][2])
+        )
+        for i, (_, operation) in enumerate(roles)
+    ]
+
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+
+    with app.app_context():
+        db.get_engine().dispose()
+
+    report = {}
+    for role in ('read', 'write'):
+        latencies = [
+            latency
+            for name, samples, _ in results if name == role
+            for latency in samples
+        ]
+        errors = sum(
+            len(failed) for name, _, failed in results if name == role
+        )
+        report[role] = summary(latencies, errors, elapsed)
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=50000)
+    parser.add_argument('--avg-follows', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=1)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--profile', choices=sorted(PROFILES), action='append',
+                        help='profile to run, defaults to all of them')
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    template = os.path.join(directory, 'template.db')
+
+    try:
+        # generated once in rollback journal mode, then copied per profile
+        app = create_app(profile_config('defaults', template))
+        with app.app_context():
+            db.create_all()
+            load(Generator(
+                args.users, args.posts, args.avg_follows, seed=args.seed
+            ))
+            db.session.remove()
+            db.get_engine().dispose()
+
+        report = {
+            'meta': dict(vars(args), revision=git_revision()),
+            'profiles': {}
+        }
+        for profile in args.profile or sorted(PROFILES):
+            path = os.path.join(directory, profile + '.db')
+            shutil.copy(template, path)
+            report['profiles'][profile] = run_profile(profile, path, args)
+    finally:
+        shutil.rmtree(directory)
+
+    print('{:<9} {:<6} {:>9} {:>9} {:>9} {:>7}'.format(
+        'profile', 'op', 'per sec', 'p50 ms', 'p99 ms', 'errors'
+    ))
+    for profile, results in report['profiles'].items():
+        for role, result in results.items():
+            print('{:<9} {:<6} {per_second:>9.1f} {p50:>9} {p99:>9} '
+                  '{errors:>7}'.format(
+                      profile, role,
+                      p50=result['p50_ms'], p99=result['p99_ms'], **result
+                  ))
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
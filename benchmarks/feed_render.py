@@ -0,0 +1,80 @@
+"""
+time spent rendering a feed page, with and without the post fragment
+cache
+
+    python -m benchmarks.feed_render --repeat 200
+"""
+import argparse
+import statistics
+from datetime import datetime
+from time import perf_counter
+
+from flask import current_app
+from flask import render_template
+
+from app import create_app, db
+from app.fragments import post_fragments
+from app.models import User, Post
+from config import Config
+
+
+def render_times(posts, repeat: int) -> list:
+    samples = []
+
+    with current_app.test_request_context('/explore'):
+        for _ in range(repeat):
+            start = perf_counter()
+            render_template('index.html', title='Explore', posts=posts)
+            samples.append((perf_counter() - start) * 1000)
+
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    # no log handlers, the app only opens an in memory database
+    class BenchmarkConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+    app = create_app(BenchmarkConfig)
+    app.app_context().push()
+
+    db.create_all()
+
+    per_page = app.config['POSTS_PER_PAGE']
+    authors = [
+        User(username='user{}'.format(i), email='user{}@example.com'.format(i))
+        for i in range(per_page)
+    ]
+    posts = [
+        Post(body='post {}'.format(i), author=authors[i],
+             timestamp=datetime.utcnow())
+        for i in range(per_page)
+    ]
+    db.session.add_all(authors + posts)
+    db.session.commit()
+    posts = Post.query.all()
+    for post in posts:
+        post.author.username
+
+    enabled = post_fragments.max_weight
+    post_fragments.max_weight = 0
+    uncached = render_times(posts, args.repeat)
+
+    post_fragments.max_weight = enabled
+    post_fragments.clear()
+    cached = render_times(posts, args.repeat)
+
+    for label, samples in (('uncached', uncached), ('cached', cached)):
+        print('{:<9} median {:>7.3f} ms   max {:>7.3f} ms'.format(
+            label, statistics.median(samples), max(samples)
+        ))
+    print('fragment cache: {}'.format(post_fragments.stats()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+query plans and latencies of the feed queries, with and without the
+follow graph indexes
+
+    python -m benchmarks.follow_graph --users 5000 --avg-follows 100
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+from time import perf_counter
+
+from flask import current_app
+
+from app import create_app, db
+from app.models import User, Post, followers
+from app.pagination import encode_cursor
+from app.pagination import keyset_paginate
+from benchmarks.generator import Generator, load
+from config import Config
+
+
+def drop_indexes() -> None:
+    """
+    bring the schema back to its unindexed, unkeyed layout
+    """
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql('DROP INDEX ix_post_user_id_timestamp')
+        connection.exec_driver_sql('DROP INDEX ix_followers_followed_id')
+        connection.exec_driver_sql(
+            'CREATE TABLE followers_legacy '
+            '(follower_id INTEGER, followed_id INTEGER)'
+        )
+        connection.exec_driver_sql(
+            'INSERT INTO followers_legacy SELECT * FROM followers'
+        )
+        connection.exec_driver_sql('DROP TABLE followers')
+        connection.exec_driver_sql(
+            'ALTER TABLE followers_legacy RENAME TO followers'
+        )
+        connection.exec_driver_sql('ANALYZE')
+
+
+def explain(query) -> list:
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = db.session.connection().exec_driver_sql(
+        'EXPLAIN QUERY PLAN ' + str(compiled),
+        params
+    ).fetchall()
+    return [row[-1] for row in rows]
+
+
+def timed(func, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        samples.append((perf_counter() - start) * 1000)
+
+    samples.sort()
+    return {
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[int(len(samples) * 0.95) - 1], 3)
+    }
+
+
+def measure(reader: User, target: User, repeat: int) -> dict:
+    per_page = current_app.config['POSTS_PER_PAGE']
+    newest = (Post.timestamp.desc(), Post.id.desc())
+    feed = reader.followed_posts().order_by(None)
+    deep = feed.order_by(*newest).offset(1000).first()
+    key = db.tuple_(Post.timestamp, Post.id)
+
+    cases = {
+        'followed_posts': (
+            feed.order_by(*newest).limit(per_page),
+            lambda: keyset_paginate(reader.followed_posts(), per_page)
+        ),
+        # the page after the 1000th newest post of the feed
+        'followed_deep': (
+            feed.filter(
+                key < db.tuple_(deep.timestamp, deep.id)
+            ).order_by(*newest).limit(per_page),
+            lambda: keyset_paginate(
+                reader.followed_posts(), per_page, after=encode_cursor(deep)
+            )
+        ),
+        # the query behind is_following, without the follow graph cache
+        'is_following': (
+            reader.followed.filter(followers.c.followed_id == target.id),
+            lambda: reader.follows_in_db(target)
+        ),
+        'profile_feed': (
+            target.posts.order_by(*newest).limit(per_page),
+            lambda: keyset_paginate(target.posts, per_page)
+        )
+    }
+
+    report = {}
+    for name, (query, func) in cases.items():
+        report[name] = dict(plan=explain(query), **timed(func, repeat))
+        db.session.expire_all()
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--avg-follows', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+
+    # no log handlers, the app only opens the temporary database
+    class BenchmarkConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+
+    app = create_app(BenchmarkConfig)
+    app.app_context().push()
+
+    try:
+        db.create_all()
+        load(Generator(
+            args.users, args.posts, args.avg_follows, seed=args.seed
+        ))
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql('ANALYZE')
+
+        # the heaviest follower and the most popular user
+        reader_id = db.session.query(User.id).order_by(
+            User.followed_count.desc()
+        ).first()[0]
+        reader, target = User.query.get(reader_id), User.query.get(1)
+        after = measure(reader, target, args.repeat)
+
+        db.session.remove()
+        drop_indexes()
+        reader, target = User.query.get(reader_id), User.query.get(1)
+        before = measure(reader, target, args.repeat)
+        db.session.remove()
+    finally:
+        os.remove(path)
+
+    report = {'before': before, 'after': after}
+
+    for name in after:
+        print(name)
+        for label in ('before', 'after'):
+            result = report[label][name]
+            print('  {:<7} median {:>9.3f} ms   p95 {:>9.3f} ms'.format(
+                label, result['median_ms'], result['p95_ms']
+            ))
+            for line in result['plan']:
+                print('            ' + line)
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
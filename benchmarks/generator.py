@@ -0,0 +1,143 @@
+"""
+deterministic synthetic data: users, a power-law follow graph and posts
+
+the same seed always yields the same records, which are plain dicts
+accepted by app.bulk_import.import_rows
+"""
+import random
+from bisect import bisect
+from datetime import datetime
+from datetime import timedelta
+from itertools import accumulate
+
+from app import db
+from app.bulk_import import import_rows
+from app.models import reconcile_counters
+
+# posts are spread over this period, ending at EPOCH
+EPOCH = datetime(2026, 1, 1)
+PERIOD = timedelta(days=365)
+
+# words of the post bodies, the word of rank r is used proportionally to
+# 1 / r like in natural language
+SYLLABLES = [
+    consonant + vowel
+    for consonant in 'bcdfghjklmnpqrstvwxyz'
+    for vowel in 'aeiou'
+] + ['ka', 'lo', 'mi', 'ne', 'ru']
+VOCABULARY_SIZE = 50000
+WORDS_PER_POST = (4, 20)
+
+
+def word(rank: int) -> str:
+    """
+    :return: the pseudo-word of a rank, 0 being the most frequent
+    """
+    syllables = []
+    while True:
+        rank, digit = divmod(rank, len(SYLLABLES))
+        syllables.append(SYLLABLES[digit])
+        if not rank:
+            return ''.join(syllables)
+        rank -= 1
+
+
+class Generator:
+    """
+    popularity follows a Zipf law of exponent `skew`: the user of rank r
+    is followed and posts proportionally to 1 / r ** skew, and the
+    number of users each one follows is drawn from a Pareto distribution
+    of mean `avg_follows`
+    """
+
+    def __init__(self, users: int, posts: int, avg_follows: int = 20,
+                 skew: float = 1.0, seed: int = 42):
+        self.users = users
+        self.posts = posts
+        self.avg_follows = avg_follows
+        self.skew = skew
+        self.seed = seed
+        self._weights = list(accumulate(
+            1 / rank ** skew for rank in range(1, users + 1)
+        ))
+        self._vocabulary = [word(rank) for rank in range(VOCABULARY_SIZE)]
+        self._word_weights = list(accumulate(
+            1 / rank for rank in range(1, VOCABULARY_SIZE + 1)
+        ))
+
+    def _popular(self, rng: random.Random) -> int:
+        """
+        :return: a user id drawn by popularity, id 1 is the most popular
+        """
+        point = rng.random() * self._weights[-1]
+        return min(bisect(self._weights, point), self.users - 1) + 1
+
+    def user_records(self):
+        for i in range(1, self.users + 1):
+            yield {
+                'id': i,
+                'username': 'user{}'.format(i),
+                'email': 'user{}@example.com'.format(i)
+            }
+
+    def follow_records(self):
+        rng = random.Random(self.seed)
+        alpha = 1.5
+        scale = self.avg_follows * (alpha - 1) / alpha
+
+        for follower in range(1, self.users + 1):
+            wanted = min(
+                int(scale * rng.paretovariate(alpha)),
+                self.users - 1
+            )
+            followed = set()
+
+            # bounded attempts, popular users get drawn again and again
+            for _ in range(wanted * 3):
+                if len(followed) >= wanted:
+                    break
+                candidate = self._popular(rng)
+                if candidate != follower:
+                    followed.add(candidate)
+
+            for followed_id in sorted(followed):
+                yield {'follower_id': follower, 'followed_id': followed_id}
+
+    def body(self, rng: random.Random) -> str:
+        return ' '.join(rng.choices(
+            self._vocabulary,
+            cum_weights=self._word_weights,
+            k=rng.randint(*WORDS_PER_POST)
+        ))
+
+    def post_records(self):
+        rng = random.Random(self.seed + 1)
+        # the authors do not depend on the bodies
+        words = random.Random(self.seed + 2)
+        step = PERIOD / max(self.posts, 1)
+
+        for i in range(self.posts):
+            yield {
+                'user_id': self._popular(rng),
+                'body': 'post {} {}'.format(i, self.body(words)),
+                'timestamp': EPOCH - PERIOD + step * i
+            }
+
+
+def load(generator: Generator, batch_size: int = 20000) -> dict:
+    """
+    bulk inserts the generated data and sets the counters
+
+    :return: the import report of each kind
+    """
+    reports = {
+        'users': import_rows('users', generator.user_records(), batch_size),
+        'follows': import_rows(
+            'follows', generator.follow_records(), batch_size
+        ),
+        'posts': import_rows('posts', generator.post_records(), batch_size),
+    }
+    reconcile_counters()
+    db.session.commit()
+
+    return reports
@@ -0,0 +1,263 @@
+"""
+latency, queries and memory of the hot routes, driven through the Flask
+test client against a generated database
+
+    python -m benchmarks.routes --users 2000 --posts 100000 --json out.json
+    python -m benchmarks.routes --compare out.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+from flask import current_app
+from sqlalchemy import event
+
+from app import create_app, db
+from app.last_seen import last_seen
+from app.models import Post, User, followers, timeline
+from app.pagination import encode_cursor
+from benchmarks.generator import Generator, load
+from config import Config
+
+
+def percentile(samples: list, rank: float) -> float:
+    ordered = sorted(samples)
+    index = max(0, int(round(rank / 100 * len(ordered))) - 1)
+    return ordered[index]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def log_in(client, usr_id: int) -> None:
+    with client.session_transaction() as session:
+        session['_user_id'] = str(usr_id)
+        session['_fresh'] = True
+
+
+def hot_routes(reader: User, author: User) -> dict:
+    """
+    :return: name -> url, deep pages start after the 1000th newest post
+    """
+    deep = author.posts.order_by(
+        db.desc('timestamp')
+    ).offset(min(1000, author.posts_count - 1)).first()
+
+    routes = {
+        'index': '/index',
+        'explore': '/explore',
+        'user': '/user/{}'.format(author.username),
+    }
+    if deep is not None:
+        routes['user_deep'] = '/user/{}?after={}'.format(
+            author.username,
+            encode_cursor(deep)
+        )
+        routes['explore_deep'] = '/explore?after={}'.format(
+            encode_cursor(deep)
+        )
+
+    deep_feed = reader.followed_posts().order_by(None).order_by(
+        Post.timestamp.desc(),
+        Post.id.desc()
+    ).offset(1000).first()
+    if deep_feed is not None:
+        routes['index_deep'] = '/index?after={}'.format(
+            encode_cursor(deep_feed)
+        )
+
+    return routes
+
+
+def full_timelines(usr_id: int) -> int:
+    """
+    :return: the number of followers of a user whose timeline is at the cap
+    """
+    sizes = db.select([
+        db.func.count().label('size')
+    ]).select_from(
+        followers.join(timeline, timeline.c.user_id == followers.c.follower_id)
+    ).where(
+        followers.c.followed_id == usr_id
+    ).group_by(
+        followers.c.follower_id
+    ).subquery()
+
+    return db.session.execute(
+        db.select([db.func.count()]).where(
+            sizes.c.size >= current_app.config['TIMELINE_MAX_LEN']
+        )
+    ).scalar()
+
+
+def measure(client, url: str, requests: int, warmup: int,
+            data: dict = None) -> dict:
+    """
+    :param data: the form to post, the route is read when None
+    """
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    def send():
+        if data is None:
+            return client.get(url), 200
+        return client.post(url, data=data), 302
+
+    for _ in range(warmup):
+        send()
+
+    latencies = []
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        for _ in range(requests):
+            start = perf_counter()
+            response, expected = send()
+            latencies.append((perf_counter() - start) * 1000)
+            assert response.status_code == expected, \
+                (url, response.status_code)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    # separate pass, tracing allocations slows the requests down
+    tracemalloc.start()
+    send()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'queries': len(statements) / requests,
+        'peak_kib': round(peak / 1024, 1)
+    }
+
+
+def compare(report: dict, baseline: dict) -> None:
+    print('\ncompared to {}:'.format(
+        baseline['meta'].get('revision') or 'baseline'
+    ))
+    for name, result in report['routes'].items():
+        before = baseline['routes'].get(name)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'queries'):
+            if before[metric]:
+                change = (result[metric] - before[metric]) / before[metric]
+                print('  {:<13} {:<8} {:>+7.1%}'.format(name, metric, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--avg-follows', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--timeline', action='store_true',
+                        help='read the home feed from materialized timelines '
+                             'and time publishing to them')
+    parser.add_argument('--timeline-max-len', type=int, default=None,
+                        help='cap of the timelines, lower it so that the '
+                             'generated ones are full')
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--compare', help='previous report to compare to')
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+
+    # no log handlers, the app only opens the temporary database
+    class BenchmarkConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+
+    app = create_app(BenchmarkConfig)
+    app.app_context().push()
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    try:
+        db.create_all()
+        generator = Generator(
+            args.users, args.posts, args.avg_follows, seed=args.seed
+        )
+        load(generator)
+
+        if args.timeline:
+            app.config['TIMELINE_ENABLED'] = True
+            if args.timeline_max_len:
+                app.config['TIMELINE_MAX_LEN'] = args.timeline_max_len
+            for usr in User.query:
+                usr.rebuild_timeline()
+            db.session.commit()
+
+        # the heaviest follower reads, the most popular user is viewed
+        reader_id = db.session.query(User.id).order_by(
+            User.followed_count.desc()
+        ).first()[0]
+        author = User.query.get(1)
+        routes = hot_routes(User.query.get(reader_id), author)
+        meta = dict(vars(args), revision=git_revision())
+        if args.timeline:
+            meta['full_timelines'] = full_timelines(author.id)
+            meta['followers'] = author.followers_count
+        db.session.remove()
+
+        client = app.test_client()
+        log_in(client, reader_id)
+        report = {
+            'meta': meta,
+            'routes': {
+                name: measure(client, url, args.requests, args.warmup)
+                for name, url in routes.items()
+            }
+        }
+
+        # the most followed user posts, fanning out to every follower
+        if args.timeline:
+            publisher = app.test_client()
+            log_in(publisher, author.id)
+            report['routes']['publish'] = measure(
+                publisher, '/index', args.requests, args.warmup,
+                data={'post': 'benchmark post'}
+            )
+    finally:
+        last_seen.flush()
+        db.session.remove()
+        os.remove(path)
+
+    if args.timeline:
+        print('{full_timelines} of {followers} follower timelines '
+              'full'.format(**report['meta']))
+    print('{:<13} {:>9} {:>9} {:>9} {:>8} {:>10}'.format(
+        'route', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'peak KiB'
+    ))
+    for name, result in report['routes'].items():
+        print('{:<13} {p50_ms:>9.2f} {p95_ms:>9.2f} {p99_ms:>9.2f} '
+              '{queries:>8.1f} {peak_kib:>10.1f}'.format(name, **result))
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(report, json.load(baseline))
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+latency of the full-text search of posts against a LIKE scan, for common,
+rare, multi-word and prefix searches, on the first page and deep pages
+
+    python -m benchmarks.search --posts 2000000
+"""
+import argparse
+import json
+import os
+import tempfile
+from time import perf_counter
+
+from flask import current_app
+
+from app import create_app, db
+from app.bulk_import import import_rows
+from app.models import Post
+from app.routes import with_authors
+from app.search import match_expression
+from app.search import search_posts
+from benchmarks.generator import Generator, word
+from benchmarks.routes import git_revision, percentile
+from config import Config
+
+# searches by the rank of their words in the vocabulary
+SEARCHES = {
+    'common': word(0),
+    'frequent': word(20),
+    'rare': word(20000),
+    'two_words': '{} {}'.format(word(3), word(300)),
+    'prefix': word(150)[:3] + '*'
+}
+
+
+def like_page(text: str, per_page: int) -> list:
+    """
+    the search without an index: newest posts containing every word
+    """
+    query = Post.query
+    for term in text.split():
+        query = query.filter(Post.body.like('%{}%'.format(term.rstrip('*'))))
+
+    return query.options(with_authors).order_by(
+        Post.id.desc()
+    ).limit(per_page).all()
+
+
+def deep_cursor(text: str, per_page: int, depth: int):
+    """
+    :return: the cursor of the page reached after depth pages
+    """
+    page = search_posts(text, per_page)
+    cursor = None
+    for _ in range(depth):
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
+        page = search_posts(text, per_page, after=cursor)
+
+    return cursor
+
+
+def timed(func, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        samples.append((perf_counter() - start) * 1000)
+        db.session.remove()
+
+    return {
+        'p50_ms': round(percentile(samples, 50), 3),
+        'p95_ms': round(percentile(samples, 95), 3)
+    }
+
+
+def measure(args) -> dict:
+    per_page = current_app.config['POSTS_PER_PAGE']
+    report = {}
+
+    for name, text in SEARCHES.items():
+        cursor = deep_cursor(text, per_page, args.depth)
+        report[name] = {
+            'fts_first': timed(
+                lambda: search_posts(text, per_page), args.repeat
+            ),
+            'fts_deep': timed(
+                lambda: search_posts(text, per_page, after=cursor),
+                args.repeat
+            ),
+            # every match ranked
+            'fts_all': timed(
+                lambda: search_posts(text, per_page, candidates=args.posts),
+                args.repeat
+            ),
+            'like_first': timed(
+                lambda: like_page(text, per_page), args.like_repeat
+            ),
+            'matches': db.session.execute(
+                'SELECT count(*) FROM post_search WHERE post_search MATCH :q',
+                {'q': match_expression(text)}
+            ).scalar()
+        }
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--like-repeat', type=int, default=3,
+                        help='runs of each LIKE scan, they are slow')
+    parser.add_argument('--depth', type=int, default=20,
+                        help='pages before the deep page')
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+
+    # no log handlers, the app only opens the temporary database
+    class BenchmarkConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+
+    app = create_app(BenchmarkConfig)
+    app.app_context().push()
+
+    try:
+        db.create_all()
+        generator = Generator(args.users, args.posts, 0, seed=args.seed)
+        import_rows('users', generator.user_records(), 20000)
+        # the search index is built once, after the posts
+        load = import_rows(
+            'posts', generator.post_records(), 20000, drop_indexes=True
+        )
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql('ANALYZE')
+
+        report = {
+            'meta': dict(vars(args), revision=git_revision(),
+                         load_seconds=load['seconds']),
+            'searches': measure(args)
+        }
+        db.session.remove()
+    finally:
+        os.remove(path)
+
+    print('{:<10} {:<10} {:>9} {:>10} {:>10}'.format(
+        'search', 'page', 'matches', 'p50 ms', 'p95 ms'
+    ))
+    for name, result in report['searches'].items():
+        for page in ('fts_first', 'fts_deep', 'fts_all', 'like_first'):
+            print('{:<10} {:<10} {:>9} {p50_ms:>10.3f} {p95_ms:>10.3f}'.format(
+                name, page, result['matches'], **result[page]
+            ))
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
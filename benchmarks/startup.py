@@ -0,0 +1,125 @@
+"""
+cold start of a worker: import of the app package, create_app and the
+first request, each run in a fresh interpreter
+
+    python -m benchmarks.startup --runs 10 --budget-ms 1500 --json out.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+# modules left to the code paths needing them (flask db, error mails)
+DEFERRED_MODULES = ('flask_migrate', 'alembic', 'smtplib')
+
+PHASES = ('import_ms', 'create_app_ms', 'first_request_ms', 'total_ms')
+
+
+def cold_start(url: str) -> dict:
+    """
+    timings of this interpreter, which must not have imported app yet
+    """
+    start = perf_counter()
+    from app import create_app
+    from config import Config
+    imported = perf_counter()
+
+    class StartupConfig(Config):
+        # no log files
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+    app = create_app(StartupConfig)
+    created = perf_counter()
+
+    status = app.test_client().get(url).status_code
+    served = perf_counter()
+
+    return {
+        'import_ms': (imported - start) * 1000,
+        'create_app_ms': (created - imported) * 1000,
+        'first_request_ms': (served - created) * 1000,
+        'total_ms': (served - start) * 1000,
+        'status': status,
+        'deferred_loaded': [
+            name for name in DEFERRED_MODULES if name in sys.modules
+        ]
+    }
+
+
+def run(url: str, cwd: str) -> dict:
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.startup', '--child', '--url', url],
+        cwd=cwd,
+        env=dict(os.environ, PYTHONPATH=os.getcwd())
+    )
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--url', default='/register',
+                        help='first request, should not need the database')
+    parser.add_argument('--budget-ms', type=float,
+                        help='exit with status 1 if the median total is over')
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(cold_start(args.url)))
+        return
+
+    # not imported by the children, it imports the app package
+    from benchmarks.routes import git_revision
+
+    # the workers log to logs/ in their working directory
+    with tempfile.TemporaryDirectory() as cwd:
+        runs = [run(args.url, cwd) for _ in range(args.runs)]
+
+    report = {
+        'meta': dict(vars(args), revision=git_revision()),
+        'phases': {
+            phase: {
+                'median': round(statistics.median(
+                    result[phase] for result in runs
+                ), 1),
+                'max': round(max(result[phase] for result in runs), 1)
+            }
+            for phase in PHASES
+        },
+        'status': sorted({result['status'] for result in runs}),
+        'deferred_loaded': sorted({
+            name for result in runs for name in result['deferred_loaded']
+        })
+    }
+
+    print('{:<17} {:>9} {:>9}'.format('phase', 'median', 'max'))
+    for phase in PHASES:
+        print('{:<17} {median:>9.1f} {max:>9.1f}'.format(
+            phase, **report['phases'][phase]
+        ))
+    if report['deferred_loaded']:
+        print('loaded at startup: {}'.format(
+            ', '.join(report['deferred_loaded'])
+        ))
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    total = report['phases']['total_ms']['median']
+    if args.budget_ms is not None and total > args.budget_ms:
+        print('over budget: {:.1f} ms > {:.1f} ms'.format(
+            total, args.budget_ms
+        ))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,16 +12,96 @@ class Config:
     # login
     SECRET_KEY = environ.get('SECRET_KEY') or 'super-secret_key'
 
+    # werkzeug method string, including the cost parameters
+    PASSWORD_HASH_METHOD = environ.get('PASSWORD_HASH_METHOD') \
+        or 'pbkdf2:sha256:260000'
+
+    PASSWORD_HASH_WORKERS = int(
+        environ.get('PASSWORD_HASH_WORKERS')
+        or 2
+    )
+
+    PASSWORD_HASH_QUEUE = int(
+        environ.get('PASSWORD_HASH_QUEUE')
+        or 16
+    )
+
     #
     # database
     SQLALCHEMY_DATABASE_URI = environ.get('DATABASE_URL') or \
         'sqlite:///' + path.join(
             basedir,
-            'app.db)'
+            'app.db'
         )
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # connections kept open per process, 0 opens one per checkout
+    DATABASE_POOL_SIZE = int(
+        environ.get('DATABASE_POOL_SIZE')
+        or 5
+    )
+
+    DATABASE_MAX_OVERFLOW = int(
+        environ.get('DATABASE_MAX_OVERFLOW')
+        or 10
+    )
+
+    # seconds waited for a connection before giving up
+    DATABASE_POOL_TIMEOUT = int(
+        environ.get('DATABASE_POOL_TIMEOUT')
+        or 30
+    )
+
+    DATABASE_POOL_RECYCLE = int(
+        environ.get('DATABASE_POOL_RECYCLE')
+        or 3600
+    )
+
+    # read replicas, comma separated, the reads of the requests are
+    # spread among them
+    DATABASE_REPLICA_URLS = [
+        url for url in (environ.get('DATABASE_REPLICA_URLS') or '').split(',')
+        if url
+    ]
+
+    # seconds during which the reads of a user who wrote go to the primary,
+    # should exceed the replication lag
+    DATABASE_READ_YOUR_WRITES = int(
+        environ.get('DATABASE_READ_YOUR_WRITES')
+        or 5
+    )
+
+    # seconds a failed replica is left out
+    DATABASE_REPLICA_RETRY = int(
+        environ.get('DATABASE_REPLICA_RETRY')
+        or 30
+    )
+
+    # SQLite pragmas set on each new connection, None keeps the default
+    SQLITE_JOURNAL_MODE = environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+
+    SQLITE_SYNCHRONOUS = environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+
+    SQLITE_MMAP_SIZE = int(
+        environ.get('SQLITE_MMAP_SIZE')
+        or 256 * 1024 * 1024
+    )
+
+    # negative values are in KiB
+    SQLITE_CACHE_SIZE = int(
+        environ.get('SQLITE_CACHE_SIZE')
+        or -64 * 1024
+    )
+
+    # milliseconds a connection waits for a lock held by another one
+    SQLITE_BUSY_TIMEOUT = int(
+        environ.get('SQLITE_BUSY_TIMEOUT')
+        or 5000
+    )
+
+    SQLITE_TEMP_STORE = environ.get('SQLITE_TEMP_STORE') or 'MEMORY'
+
     #
     # errors
     MAIL_SERVER = environ.get('MAIL_SERVER')
@@ -37,10 +117,172 @@ class Config:
 
     MAIL_PASSWORD = environ.get('MAIL_PASSWORD')
 
+    # seconds between two error digests
+    MAIL_DIGEST_INTERVAL = int(
+        environ.get('MAIL_DIGEST_INTERVAL')
+        or 300
+    )
+
+    LOG_QUEUE_SIZE = 10000
+
     ADMINS = [
         'your-email@example.com',
     ]
 
+    # requests slower than this are logged, in milliseconds
+    SLOW_REQUEST_THRESHOLD = int(
+        environ.get('SLOW_REQUEST_THRESHOLD')
+        or 500
+    )
+
+    #
+    # profiling, a request is profiled if sampled or if it carries a
+    # X-Profile header signed by 'flask profile-token'
+    PROFILER_SAMPLE_RATE = float(
+        environ.get('PROFILER_SAMPLE_RATE')
+        or 0
+    )
+
+    PROFILER_DIR = environ.get('PROFILER_DIR') \
+        or path.join(basedir, 'profiles')
+
+    # dumps kept per endpoint
+    PROFILER_RETENTION = int(
+        environ.get('PROFILER_RETENTION')
+        or 20
+    )
+
+    # seconds
+    PROFILER_TRIGGER_MAX_AGE = 300
+
     #
     # pagination
     POSTS_PER_PAGE = 25
+
+    #
+    # search, only the newest matches are ranked
+    SEARCH_MAX_CANDIDATES = int(
+        environ.get('SEARCH_MAX_CANDIDATES')
+        or 2000
+    )
+
+    #
+    # trending hashtags, half-life in seconds of each window
+    TRENDING_WINDOWS = {
+        'hour': 3600,
+        'day': 86400
+    }
+
+    TRENDING_TOP_K = int(
+        environ.get('TRENDING_TOP_K')
+        or 10
+    )
+
+    # hashtags counted in memory per window, the least used are dropped
+    TRENDING_CAPACITY = int(
+        environ.get('TRENDING_CAPACITY')
+        or 10000
+    )
+
+    # seconds between two writes of the counts, which also reads the
+    # counts of the other workers
+    TRENDING_FLUSH_INTERVAL = int(
+        environ.get('TRENDING_FLUSH_INTERVAL')
+        or 60
+    )
+
+    #
+    # server-sent events of the new posts on the home page, off by default
+    # as each open stream holds a worker thread
+    EVENTS_ENABLED = environ.get('EVENTS_ENABLED') is not None
+
+    # events kept per client before the oldest are dropped
+    EVENTS_QUEUE_SIZE = int(
+        environ.get('EVENTS_QUEUE_SIZE')
+        or 100
+    )
+
+    # each stream holds a worker thread
+    EVENTS_MAX_SUBSCRIBERS = int(
+        environ.get('EVENTS_MAX_SUBSCRIBERS')
+        or 1000
+    )
+
+    # seconds
+    EVENTS_KEEPALIVE = int(
+        environ.get('EVENTS_KEEPALIVE')
+        or 15
+    )
+
+    # sockets relaying the events between the worker processes of the
+    # host, None for a single process
+    EVENTS_SOCKET_DIR = environ.get('EVENTS_SOCKET_DIR')
+
+    #
+    # activity tracking, in seconds
+    LAST_SEEN_GRANULARITY = int(
+        environ.get('LAST_SEEN_GRANULARITY')
+        or 60
+    )
+
+    LAST_SEEN_FLUSH_INTERVAL = int(
+        environ.get('LAST_SEEN_FLUSH_INTERVAL')
+        or 30
+    )
+
+    LAST_SEEN_FLUSH_SIZE = int(
+        environ.get('LAST_SEEN_FLUSH_SIZE')
+        or 500
+    )
+
+    #
+    # caches
+    FOLLOW_CACHE_MAX_BYTES = int(
+        environ.get('FOLLOW_CACHE_MAX_BYTES')
+        or 16 * 1024 * 1024
+    )
+
+    # seconds
+    FOLLOW_CACHE_TTL = int(
+        environ.get('FOLLOW_CACHE_TTL')
+        or 60
+    )
+
+    USER_CACHE_SIZE = int(
+        environ.get('USER_CACHE_SIZE')
+        or 10000
+    )
+
+    # seconds
+    USER_CACHE_TTL = int(
+        environ.get('USER_CACHE_TTL')
+        or 60
+    )
+
+    # username / email bloom filters
+    AVAILABILITY_CAPACITY = int(
+        environ.get('AVAILABILITY_CAPACITY')
+        or 1000000
+    )
+
+    AVAILABILITY_ERROR_RATE = 0.01
+
+    # seconds
+    AVAILABILITY_REFRESH = int(
+        environ.get('AVAILABILITY_REFRESH')
+        or 600
+    )
+
+    POST_FRAGMENT_CACHE_SIZE = int(
+        environ.get('POST_FRAGMENT_CACHE_SIZE')
+        or 10000
+    )
+
+    #
+    # timeline
+    TIMELINE_ENABLED = environ.get('TIMELINE_ENABLED') is not None
+
+    TIMELINE_MAX_LEN = int(
+        environ.get('TIMELINE_MAX_LEN')
+        or 800
+    )
@@ -1,5 +1,21 @@
-from app import app, db
+import os
+
+import click
+
+from app import create_app, db
+from app.bulk_import import IMPORTERS
+from app.bulk_import import import_rows
+from app.bulk_import import read_csv
+from app.bulk_import import read_ndjson
+from app.export import EXPORTS
+from app.export import FORMATS
+from app.export import export_rows
 from app.models import User, Post
+from app.models import reconcile_counters
+from app.profiler import hot_functions
+from app.search import rebuild_index
+
+app = create_app()
 
 
 @app.shell_context_processor
@@ -11,5 +27,139 @@ def make_shell_context():
     }
 
 
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']),
+              help='defaults to the extension of SOURCE')
+@click.option('--batch-size', default=5000, show_default=True,
+              help='rows per executemany')
+@click.option('--commit-every', default=200000, show_default=True,
+              help='rows per transaction')
+@click.option('--drop-indexes', is_flag=True,
+              help='drop the secondary indexes (ix_post_timestamp...) and '
+                   'the search triggers during the load and rebuild them '
+                   'afterwards')
+def import_data(kind, source, fmt, batch_size, commit_every, drop_indexes):
+    """
+    bulk load users, follows or posts from an NDJSON or CSV file ('-' for
+    stdin)
+    """
+    fmt = fmt or ('csv' if source.name.endswith('.csv') else 'ndjson')
+    records = read_csv(source) if fmt == 'csv' else read_ndjson(source)
+
+    def progress(rows):
+        if rows % (batch_size * 20) < batch_size:
+            click.echo('{} rows...'.format(rows), err=True)
+
+    report = import_rows(
+        kind,
+        records,
+        batch_size=batch_size,
+        commit_every=commit_every,
+        drop_indexes=drop_indexes,
+        progress=progress
+    )
+
+    click.echo('imported {rows} {kind} in {seconds:.1f}s '
+               '({rows_per_second:.0f} rows/s)'.format(kind=kind, **report))
+
+    # the counters are not maintained by the bulk inserts
+    if kind != 'users':
+        reconcile_counters()
+        db.session.commit()
+
+    if kind != 'users' and app.config['TIMELINE_ENABLED']:
+        click.echo('run flask rebuild-timelines to refresh the timelines')
+
+
+@app.cli.command('export')
+@click.argument('username')
+@click.argument('kind', type=click.Choice(sorted(EXPORTS)))
+@click.argument('output', type=click.File('wb'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)),
+              help='defaults to the extension of OUTPUT, else ndjson')
+@click.option('--gzip', 'compress', is_flag=True,
+              help='compress the output, implied by a .gz OUTPUT')
+def export_data(username, kind, output, fmt, compress):
+    """
+    stream the posts, followers or followed users of a user as NDJSON or
+    CSV to a file ('-' for stdout)
+    """
+    usr = User.query.filter_by(username=username).first()
+    if usr is None:
+        raise click.BadParameter(
+            'no user named {}'.format(username),
+            param_hint='USERNAME'
+        )
+
+    name = output.name
+    if name.endswith('.gz'):
+        compress = True
+        name = name[:-len('.gz')]
+    fmt = fmt or ('csv' if name.endswith('.csv') else 'ndjson')
+
+    for chunk in export_rows(kind, usr.id, fmt, compress):
+        output.write(chunk)
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """
+    recompute the materialized home timeline of every user
+    """
+    for usr in User.query:
+        usr.rebuild_timeline()
+
+    db.session.commit()
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_user_counters():
+    """
+    recompute the follower, following and post counters of every user
+    """
+    reconcile_counters()
+    db.session.commit()
+
+
+@app.cli.command('rebuild-search')
+def rebuild_search():
+    """
+    index the existing posts for /search, creating the index if needed
+    """
+    with db.engine.begin() as connection:
+        rebuild_index(connection)
+
+
+@app.cli.command('profile-token')
+def profile_token():
+    """
+    print an X-Profile header value, valid for PROFILER_TRIGGER_MAX_AGE
+    seconds, that makes the request profiled
+    """
+    click.echo(app.wsgi_app.trigger_token())
+
+
+@app.cli.command('profile-report')
+@click.argument('endpoints', nargs=-1)
+@click.option('--top', default=20, show_default=True)
+@click.option('--sort', default='cumulative', show_default=True,
+              help='pstats sort key, e.g. tottime')
+def profile_report(endpoints, top, sort):
+    """
+    print the hottest functions of the profiled requests, per endpoint
+    """
+    directory = app.config['PROFILER_DIR']
+    if not endpoints and os.path.isdir(directory):
+        endpoints = sorted(os.listdir(directory))
+
+    for endpoint in endpoints:
+        report = hot_functions(os.path.join(directory, endpoint), top, sort)
+        if report is not None:
+            click.echo('== {}'.format(endpoint))
+            click.echo(report)
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
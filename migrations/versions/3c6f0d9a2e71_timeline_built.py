@@ -0,0 +1,26 @@
+"""flag of the users whose timeline is built
+
+Revision ID: 3c6f0d9a2e71
+Revises: e8b2c4d61f07
+Create Date: 2026-10-19 09:14:26.407193
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c6f0d9a2e71'
+down_revision = 'e8b2c4d61f07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the existing timelines may be partial, 'flask rebuild-timelines'
+    # builds them and sets the flag
+    op.add_column('user', sa.Column('timeline_built', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade():
+    op.drop_column('user', 'timeline_built')
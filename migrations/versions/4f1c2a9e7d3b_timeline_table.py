@@ -0,0 +1,39 @@
+"""timeline table
+
+Revision ID: 4f1c2a9e7d3b
+Revises: bbda5675feff
+Create Date: 2026-10-18 10:12:41.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f1c2a9e7d3b'
+down_revision = 'bbda5675feff'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'timeline',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('user_id', 'post_id')
+    )
+    op.create_index(
+        'ix_timeline_user_id_timestamp',
+        'timeline',
+        ['user_id', 'timestamp'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_timeline_user_id_timestamp', table_name='timeline')
+    op.drop_table('timeline')
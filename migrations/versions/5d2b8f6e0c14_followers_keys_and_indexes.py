@@ -0,0 +1,86 @@
+"""followers keys and feed indexes
+
+Revision ID: 5d2b8f6e0c14
+Revises: c3d85e0a1b27
+Create Date: 2026-10-18 12:20:45.771902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2b8f6e0c14'
+down_revision = 'c3d85e0a1b27'
+branch_labels = None
+depends_on = None
+
+
+def _recount_follows():
+    """
+    duplicated rows inflated the counters, recompute them
+    """
+    user = sa.table(
+        'user',
+        sa.column('id', sa.Integer),
+        sa.column('followers_count', sa.Integer),
+        sa.column('followed_count', sa.Integer)
+    )
+    followers = sa.table(
+        'followers',
+        sa.column('follower_id', sa.Integer),
+        sa.column('followed_id', sa.Integer)
+    )
+    op.execute(
+        user.update().values(
+            followers_count=sa.select([sa.func.count()]).where(
+                followers.c.followed_id == user.c.id
+            ).scalar_subquery(),
+            followed_count=sa.select([sa.func.count()]).where(
+                followers.c.follower_id == user.c.id
+            ).scalar_subquery()
+        )
+    )
+
+
+def upgrade():
+    # copy the distinct rows into a keyed table then swap them
+    op.create_table(
+        'followers_dedup',
+        sa.Column('follower_id', sa.Integer(), nullable=False),
+        sa.Column('followed_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['followed_id'], ['user.id'], ),
+        sa.ForeignKeyConstraint(['follower_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('follower_id', 'followed_id')
+    )
+    op.execute(
+        'INSERT INTO followers_dedup (follower_id, followed_id) '
+        'SELECT DISTINCT follower_id, followed_id FROM followers '
+        'WHERE follower_id IS NOT NULL AND followed_id IS NOT NULL'
+    )
+    op.drop_table('followers')
+    op.rename_table('followers_dedup', 'followers')
+
+    op.create_index(op.f('ix_followers_followed_id'), 'followers', ['followed_id'], unique=False)
+    op.create_index('ix_post_user_id_timestamp', 'post', ['user_id', 'timestamp'], unique=False)
+
+    _recount_follows()
+
+
+def downgrade():
+    op.drop_index('ix_post_user_id_timestamp', table_name='post')
+    op.drop_index(op.f('ix_followers_followed_id'), table_name='followers')
+
+    op.create_table(
+        'followers_legacy',
+        sa.Column('follower_id', sa.Integer(), nullable=True),
+        sa.Column('followed_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['followed_id'], ['user.id'], ),
+        sa.ForeignKeyConstraint(['follower_id'], ['user.id'], )
+    )
+    op.execute(
+        'INSERT INTO followers_legacy (follower_id, followed_id) '
+        'SELECT follower_id, followed_id FROM followers'
+    )
+    op.drop_table('followers')
+    op.rename_table('followers_legacy', 'followers')
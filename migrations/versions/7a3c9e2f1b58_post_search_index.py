@@ -0,0 +1,57 @@
+"""full-text search index of posts
+
+Revision ID: 7a3c9e2f1b58
+Revises: 5d2b8f6e0c14
+Create Date: 2026-10-18 19:40:12.318245
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3c9e2f1b58'
+down_revision = '5d2b8f6e0c14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 is specific to SQLite
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute(
+        "CREATE VIRTUAL TABLE post_search USING fts5("
+        "body, content='post', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')"
+    )
+    op.execute(
+        "CREATE TRIGGER post_search_insert AFTER INSERT ON post BEGIN "
+        "INSERT INTO post_search (rowid, body) VALUES (new.id, new.body); "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER post_search_delete AFTER DELETE ON post BEGIN "
+        "INSERT INTO post_search (post_search, rowid, body) "
+        "VALUES ('delete', old.id, old.body); "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER post_search_update AFTER UPDATE OF body ON post "
+        "BEGIN "
+        "INSERT INTO post_search (post_search, rowid, body) "
+        "VALUES ('delete', old.id, old.body); "
+        "INSERT INTO post_search (rowid, body) VALUES (new.id, new.body); "
+        "END"
+    )
+    op.execute("INSERT INTO post_search (post_search) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute('DROP TRIGGER IF EXISTS post_search_update')
+    op.execute('DROP TRIGGER IF EXISTS post_search_delete')
+    op.execute('DROP TRIGGER IF EXISTS post_search_insert')
+    op.execute('DROP TABLE IF EXISTS post_search')
@@ -0,0 +1,54 @@
+"""avatar hash in user model
+
+Revision ID: 9b7e1d4c2f60
+Revises: 4f1c2a9e7d3b
+Create Date: 2026-10-18 11:03:17.918342
+
+"""
+from hashlib import md5
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b7e1d4c2f60'
+down_revision = '4f1c2a9e7d3b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('avatar_hash', sa.String(length=32), nullable=True))
+
+    # backfill the digest of existing users
+    user = sa.table(
+        'user',
+        sa.column('id', sa.Integer),
+        sa.column('email', sa.String),
+        sa.column('avatar_hash', sa.String)
+    )
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select([user.c.id, user.c.email]).where(user.c.email.isnot(None))
+    ).fetchall()
+
+    if rows:
+        connection.execute(
+            user.update().where(
+                user.c.id == sa.bindparam('usr_id')
+            ).values(
+                avatar_hash=sa.bindparam('digest')
+            ),
+            [
+                {
+                    'usr_id': usr_id,
+                    'digest': md5(email.lower().encode('utf-8')).hexdigest()
+                }
+                for usr_id, email in rows
+            ]
+        )
+
+
+def downgrade():
+    op.drop_column('user', 'avatar_hash')
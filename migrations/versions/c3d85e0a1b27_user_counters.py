@@ -0,0 +1,59 @@
+"""denormalized counters in user model
+
+Revision ID: c3d85e0a1b27
+Revises: e1a4f7b3c905
+Create Date: 2026-10-18 11:41:52.306114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d85e0a1b27'
+down_revision = 'e1a4f7b3c905'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('followers_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('user', sa.Column('followed_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('user', sa.Column('posts_count', sa.Integer(), server_default='0', nullable=False))
+
+    # backfill from the follow graph and the posts
+    user = sa.table(
+        'user',
+        sa.column('id', sa.Integer),
+        sa.column('followers_count', sa.Integer),
+        sa.column('followed_count', sa.Integer),
+        sa.column('posts_count', sa.Integer)
+    )
+    followers = sa.table(
+        'followers',
+        sa.column('follower_id', sa.Integer),
+        sa.column('followed_id', sa.Integer)
+    )
+    post = sa.table(
+        'post',
+        sa.column('user_id', sa.Integer)
+    )
+    op.execute(
+        user.update().values(
+            followers_count=sa.select([sa.func.count()]).where(
+                followers.c.followed_id == user.c.id
+            ).scalar_subquery(),
+            followed_count=sa.select([sa.func.count()]).where(
+                followers.c.follower_id == user.c.id
+            ).scalar_subquery(),
+            posts_count=sa.select([sa.func.count()]).where(
+                post.c.user_id == user.c.id
+            ).scalar_subquery()
+        )
+    )
+
+
+def downgrade():
+    op.drop_column('user', 'posts_count')
+    op.drop_column('user', 'followed_count')
+    op.drop_column('user', 'followers_count')
@@ -0,0 +1,35 @@
+"""followers
+
+Revision ID: e1a4f7b3c905
+Revises: 9b7e1d4c2f60
+Create Date: 2026-10-18 11:36:08.520173
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a4f7b3c905'
+down_revision = '9b7e1d4c2f60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the table was never migrated, databases built with db.create_all()
+    # already have it
+    if sa.inspect(op.get_bind()).has_table('followers'):
+        return
+
+    op.create_table(
+        'followers',
+        sa.Column('follower_id', sa.Integer(), nullable=True),
+        sa.Column('followed_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['followed_id'], ['user.id'], ),
+        sa.ForeignKeyConstraint(['follower_id'], ['user.id'], )
+    )
+
+
+def downgrade():
+    op.drop_table('followers')
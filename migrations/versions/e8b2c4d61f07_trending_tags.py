@@ -0,0 +1,41 @@
+"""trending hashtags
+
+Revision ID: e8b2c4d61f07
+Revises: 7a3c9e2f1b58
+Create Date: 2026-10-18 20:31:07.552913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b2c4d61f07'
+down_revision = '7a3c9e2f1b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'trending_tag',
+        sa.Column('half_life', sa.Integer(), nullable=False),
+        sa.Column('tag', sa.String(length=64), nullable=False),
+        sa.Column('period', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('half_life', 'tag')
+    )
+    op.create_index(
+        'ix_trending_tag_half_life_period_score',
+        'trending_tag',
+        ['half_life', 'period', 'score'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index(
+        'ix_trending_tag_half_life_period_score',
+        table_name='trending_tag'
+    )
+    op.drop_table('trending_tag')
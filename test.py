@@ -1,17 +1,56 @@
 from datetime import datetime, timedelta
+from io import StringIO
+import gzip
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
 import unittest
-from app import app, db
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import QueuePool
+from app import create_app, db
 from app.models import User, Post
+from app.models import followers, follow_graph, reconcile_counters, timeline
+from app.models import trending_tags, user_cache
+from app.availability import BloomFilter, availability
+from app.bulk_import import import_rows, read_csv, read_ndjson
+from app.cache import LRUCache, TTLCache
+from app.events import SocketBridge, Subscriber, broker
+from app.export import export_rows
+from app.fragments import post_fragments
+from app.last_seen import LastSeenBuffer
+from app.log_pipeline import DigestMailHandler, start_pipeline
+from app.pagination import keyset_paginate
+from benchmarks.generator import Generator
+from app.passwords import PasswordHasher, PasswordHasherBusy
+from app.profiler import dump_files, hot_functions
+from app.search import drop_triggers, rebuild_index, search_posts
+from app.trending import PERIOD, DecayedTopK, extract_hashtags, trending
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
 
 
 class UserModelCase(unittest.TestCase):
     def setUp(self):
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        follow_graph.clear()
+        user_cache.clear()
+        availability.clear()
         db.create_all()
 
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        self.app_context.pop()
 
     # noinspection PyArgumentList
     def test_password_hashing(self):
@@ -20,6 +59,39 @@ class UserModelCase(unittest.TestCase):
         self.assertFalse(u.check_password('dog'))
         self.assertTrue(u.check_password('cat'))
 
+    # noinspection PyArgumentList
+    def test_password_rehash(self):
+        u = User(username='susan')
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        u.set_password('cat')
+        self.assertFalse(u.upgrade_password('cat'))
+
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+        self.assertTrue(u.upgrade_password('cat'))
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:2000$'))
+        self.assertTrue(u.check_password('cat'))
+
+    def test_password_hasher_bound(self):
+        pool = PasswordHasher(workers=1, queue=0)
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait()
+
+        worker = threading.Thread(target=pool.run, args=(slow,))
+        worker.start()
+        started.wait()
+        self.assertEqual(pool.stats()['in_flight'], 1)
+
+        # every slot is taken
+        with self.assertRaises(PasswordHasherBusy):
+            pool.run(slow)
+        release.set()
+        worker.join()
+        self.assertEqual(pool.stats()['rejected'], 1)
+        self.assertEqual(pool.stats()['completed'], 1)
+
     # noinspection PyArgumentList
     def test_avatar(self):
         u = User(username='john', email='john@example.com')
@@ -27,6 +99,13 @@ class UserModelCase(unittest.TestCase):
                                          'd4c74594d841139328695756648b6bd6'
                                          '?d=identicon&s=128'))
 
+        # the digest follows email changes
+        u.email = 'Susan@example.com'
+        self.assertEqual(u.avatar_hash, 'f3fc30174d7fd74ab6ca3c36d198fcb9')
+        self.assertEqual(u.avatar(70), ('https://www.gravatar.com/avatar/'
+                                        'f3fc30174d7fd74ab6ca3c36d198fcb9'
+                                        '?d=identicon&s=70'))
+
     # noinspection PyArgumentList
     def test_follow(self):
         u1 = User(username='john', email='john@example.com')
@@ -44,12 +123,310 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(u1.followed.first().username, 'susan')
         self.assertEqual(u2.followers.count(), 1)
         self.assertEqual(u2.followers.first().username, 'john')
+        self.assertEqual(u1.followed_count, 1)
+        self.assertEqual(u2.followers_count, 1)
 
         u1.unfollow(u2)
         db.session.commit()
         self.assertFalse(u1.is_following(u2))
         self.assertEqual(u1.followed.count(), 0)
         self.assertEqual(u2.followers.count(), 0)
+        self.assertEqual(u1.followed_count, 0)
+        self.assertEqual(u2.followers_count, 0)
+
+    # noinspection PyArgumentList
+    def test_follow_graph_cache(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        u1.follow(u3)
+        db.session.commit()
+
+        self.assertTrue(u1.is_following(u3))
+        self.assertFalse(u1.is_following(u2))
+        self.assertIn(u1.id, follow_graph)
+
+        # lookups are served from memory
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.assertTrue(u1.is_following(u3))
+            self.assertFalse(u1.is_following(u2))
+            self.assertTrue(u1.is_following(u3))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(statements, [])
+
+        # writes invalidate the cached set
+        u1.follow(u2)
+        self.assertNotIn(u1.id, follow_graph)
+        self.assertTrue(u1.is_following(u2))
+        u1.unfollow(u3)
+        self.assertFalse(u1.is_following(u3))
+        db.session.commit()
+
+        # a write of another worker is seen once the entry expired
+        follow_graph.ttl = 0
+        follow_graph.clear()
+        try:
+            self.assertFalse(u1.is_following(u3))
+            db.session.execute(followers.insert().values(
+                follower_id=u1.id, followed_id=u3.id
+            ))
+            db.session.commit()
+            self.assertTrue(u1.is_following(u3))
+        finally:
+            follow_graph.ttl = self.app.config['FOLLOW_CACHE_TTL']
+
+        # following again drops the stale set, the row already exists
+        u1.is_following(u3)
+        self.assertIn(u1.id, follow_graph)
+        u1.follow(u3)
+        self.assertNotIn(u1.id, follow_graph)
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        names = ['user{}'.format(i) for i in range(1000)]
+        for name in names:
+            bloom.add(name)
+
+        self.assertTrue(all(name in bloom for name in names))
+        false_positives = sum(
+            'other{}'.format(i) in bloom for i in range(10000)
+        )
+        self.assertLess(false_positives, 300)
+
+    # noinspection PyArgumentList
+    def test_availability(self):
+        db.session.add(User(username='john', email='john@example.com'))
+        db.session.commit()
+
+        self.assertTrue(availability.username_taken('john'))
+        self.assertTrue(availability.email_taken('john@example.com'))
+        self.assertFalse(availability.username_taken('susan'))
+        self.assertEqual(availability.skipped, 1)
+
+        # inserts are indexed right away
+        db.session.add(User(username='susan', email='susan@example.com'))
+        db.session.commit()
+        self.assertTrue(availability.username_taken('susan'))
+
+        # so are renames, other updates are not
+        susan = User.query.filter_by(username='susan').first()
+        count = availability._filters['username'].count
+        susan.about_me = 'hello'
+        susan.posts_count = 3
+        db.session.commit()
+        self.assertEqual(availability._filters['username'].count, count)
+        susan.username = 'susanna'
+        db.session.commit()
+        self.assertEqual(availability._filters['username'].count, count + 1)
+        self.assertTrue(availability.username_taken('susanna'))
+        susan.username = 'susan'
+        db.session.commit()
+
+        response = self.app.test_client().get('/available?username=susan')
+        self.assertEqual(response.get_json(),
+                         {'username': 'susan', 'available': False})
+        # emails are not answered, they would reveal the accounts
+        response = self.app.test_client().get('/available?email=susan@example.com')
+        self.assertEqual(response.status_code, 400)
+
+    def test_availability_startup(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        class FileDatabase(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(
+                directory, 'app.db'
+            )
+
+        # no schema yet, the filters are built on first use
+        app = create_app(FileDatabase)
+        self.assertIsNone(availability._filters)
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(username='john', email='john@example.com'))
+            db.session.commit()
+            db.session.remove()
+
+        # the filters are ready before the first lookup
+        app = create_app(FileDatabase)
+        self.assertIn('john', availability._filters['username'])
+        with app.app_context():
+            self.assertTrue(availability.username_taken('john'))
+            self.assertEqual(availability.checked, 1)
+
+    def test_bulk_import(self):
+        users = StringIO(
+            '{"id": 1, "username": "john", "email": "John@example.com"}\n'
+            '{"id": 2, "username": "susan", "email": "susan@example.com"}\n'
+        )
+        report = import_rows('users', read_ndjson(users), batch_size=1)
+        self.assertEqual(report['rows'], 2)
+
+        posts = StringIO(
+            'user_id,body,timestamp\n'
+            '1,first,2018-04-19T15:59:25\n'
+            '2,second,2018-04-19T16:00:00\n'
+            '2,third,2018-04-19T16:01:00\n'
+        )
+        import_rows('posts', read_csv(posts), batch_size=2,
+                    commit_every=2, drop_indexes=True)
+        follows = StringIO('follower_id,followed_id\n1,2\n1,2\n')
+        import_rows('follows', read_csv(follows))
+        reconcile_counters()
+        db.session.commit()
+
+        john, susan = User.query.get(1), User.query.get(2)
+        self.assertEqual(john.avatar_hash, 'd4c74594d841139328695756648b6bd6')
+        self.assertEqual([p.body for p in john.followed_posts()],
+                         ['third', 'second', 'first'])
+        self.assertEqual((susan.posts_count, susan.followers_count), (2, 1))
+        indexes = db.inspect(db.engine).get_indexes('post')
+        self.assertEqual(
+            {index['name'] for index in indexes},
+            {'ix_post_timestamp', 'ix_post_user_id_timestamp'}
+        )
+
+        # the unique indexes are kept while loading
+        duplicates = StringIO('{"username": "john", "email": "x@example.com"}\n')
+        with self.assertRaises(IntegrityError):
+            import_rows('users', read_ndjson(duplicates), drop_indexes=True)
+        self.assertEqual(User.query.filter_by(username='john').count(), 1)
+        self.assertIn('ix_user_username', {
+            index['name'] for index in db.inspect(db.engine).get_indexes('user')
+        })
+
+        # users imported without a password hash can't log in
+        self.assertFalse(john.check_password(''))
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        response = self.app.test_client().post(
+            '/login',
+            data={'username': 'john', 'password': 'cat'}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.location.endswith('/login'))
+
+    def test_generator(self):
+        generator = Generator(users=200, posts=500, avg_follows=10, seed=7)
+        follows = list(generator.follow_records())
+        self.assertEqual(follows, list(Generator(
+            users=200, posts=500, avg_follows=10, seed=7
+        ).follow_records()))
+        self.assertEqual(len(list(generator.post_records())), 500)
+
+        # the most popular user is followed far more than the median one
+        followed = [f['followed_id'] for f in follows]
+        self.assertGreater(followed.count(1), 5 * followed.count(100))
+
+    def test_log_pipeline(self):
+        class Outbox(logging.Handler):
+            def __init__(self):
+                super(Outbox, self).__init__()
+                self.sent = []
+
+            def emit(self, record):
+                self.sent.append(record.getMessage())
+
+        outbox = Outbox()
+        digests = DigestMailHandler(lambda: outbox, interval=3600)
+        logger = logging.getLogger('microblog.test')
+        logger.propagate = False
+        listener = start_pipeline(logger, [digests], size=100)
+
+        def fail(divisor):
+            try:
+                return 1 / divisor
+            except ZeroDivisionError:
+                logger.exception('failed')
+
+        for _ in range(3):
+            fail(0)
+        logger.error('unrelated')
+        # outside of an except block, exc_info is (None, None, None)
+        logger.exception('no exception')
+        listener.queue.join()
+
+        # the first error is sent at once, the others wait for the digest
+        self.assertEqual(len(outbox.sent), 1)
+        digests.flush()
+        self.assertEqual(len(outbox.sent), 2)
+        self.assertTrue(outbox.sent[1].startswith('4 errors, 3 distinct'))
+        self.assertIn('2 x ZeroDivisionError in', outbox.sent[1])
+        self.assertEqual(outbox.sent[1].count('1 x ERROR in'), 2)
+        digests.close()
+
+    def test_lru_cache(self):
+        cache = LRUCache(max_weight=10)
+        cache.set('a', 1, weight=4)
+        cache.set('b', 2, weight=4)
+        self.assertEqual(cache.get('a'), 1)
+
+        # 'b' is the least recently used
+        cache.set('c', 3, weight=4)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.weight, 8)
+        self.assertEqual(cache.get('b'), None)
+
+        # entries heavier than the cap are not stored
+        cache.set('d', 4, weight=11)
+        self.assertNotIn('d', cache)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # shrinking evicts down to the new bound
+        cache.resize(4)
+        self.assertEqual(list(cache._entries), ['c'])
+        self.assertEqual(cache.weight, 4)
+
+    def test_create_app(self):
+        class SmallCaches(TestConfig):
+            FOLLOW_CACHE_MAX_BYTES = 1024
+            USER_CACHE_TTL = 5
+
+        other = create_app(SmallCaches)
+        self.assertEqual(follow_graph.max_weight, 1024)
+        self.assertEqual(user_cache.ttl, 5)
+        self.assertIn('main.index', other.view_functions)
+
+        # migrations are only set up for the flask command
+        self.assertNotIn('migrate', other.extensions)
+
+    def test_sqlite_profile(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        class FileDatabase(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(
+                directory, 'app.db'
+            )
+            SQLITE_SYNCHRONOUS = 'FULL'
+
+        with create_app(FileDatabase).app_context():
+            engine = db.engine
+            self.assertIsInstance(engine.pool, QueuePool)
+            self.assertEqual(engine.pool.size(), 5)
+
+            with engine.connect() as connection:
+                def pragma(name):
+                    return connection.exec_driver_sql(
+                        'PRAGMA ' + name
+                    ).scalar()
+
+                self.assertEqual(pragma('journal_mode'), 'wal')
+                self.assertEqual(pragma('synchronous'), 2)
+                self.assertEqual(pragma('busy_timeout'), 5000)
+                self.assertEqual(pragma('cache_size'), -64 * 1024)
+                self.assertEqual(pragma('temp_store'), 2)
+
+            engine.dispose()
 
     # noinspection PyArgumentList
     def test_follow_posts(self):
@@ -90,6 +467,785 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(f3, [p3, p4])
         self.assertEqual(f4, [p4])
 
+    # noinspection PyArgumentList
+    def test_timeline(self):
+        self.app.config['TIMELINE_ENABLED'] = True
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        for u in (u1, u2, u3):
+            u.rebuild_timeline()
+        db.session.commit()
+
+        now = datetime.utcnow()
+        p1 = Post(body="post from susan", author=u2,
+                  timestamp=now + timedelta(seconds=1))
+        db.session.add(p1)
+        p1.fan_out()
+        db.session.commit()
+
+        # following backfills older posts
+        u1.follow(u2)
+        u1.follow(u3)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts().all(), [p1])
+
+        # new posts are pushed to followers
+        p2 = Post(body="post from mary", author=u3,
+                  timestamp=now + timedelta(seconds=2))
+        p3 = Post(body="post from john", author=u1,
+                  timestamp=now + timedelta(seconds=3))
+        for p in (p2, p3):
+            db.session.add(p)
+            p.fan_out()
+        db.session.commit()
+        self.assertEqual(u1.followed_posts().all(), [p3, p2, p1])
+        self.assertEqual(u3.followed_posts().all(), [p2])
+
+        # unfollowing purges
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts().all(), [p3, p2])
+
+        # timelines are capped
+        self.app.config['TIMELINE_MAX_LEN'] = 1
+        u1.rebuild_timeline()
+        db.session.commit()
+        self.assertEqual(u1.followed_posts().all(), [p3])
+        p4 = Post(body="another from mary", author=u3,
+                  timestamp=now + timedelta(seconds=4))
+        db.session.add(p4)
+        p4.fan_out()
+        db.session.commit()
+        self.assertEqual(u1.followed_posts().all(), [p4])
+
+        # a timeline is only used and maintained once built
+        u4 = User(username='david', email='david@example.com')
+        db.session.add(u4)
+        u4.follow(u3)
+        db.session.commit()
+        self.assertEqual(u4.followed_posts().all(), [p4, p2])
+        u4.follow(u1)
+        p5 = Post(body="new post from susan", author=u2,
+                  timestamp=now + timedelta(seconds=5))
+        db.session.add(p5)
+        p5.fan_out()
+        u4.follow(u2)
+        db.session.commit()
+        self.assertEqual(u4.followed_posts().all(), [p5, p4, p3, p2, p1])
+        self.assertFalse(u4.timeline_built)
+        self.assertEqual(
+            db.session.query(timeline).filter_by(user_id=u4.id).count(), 0
+        )
+
+    # noinspection PyArgumentList
+    def test_counters(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        u1.publish('first post')
+        u1.publish('second post')
+        u2.follow(u1)
+        db.session.commit()
+        self.assertEqual(u1.posts_count, 2)
+        self.assertEqual(u1.followers_count, 1)
+        self.assertEqual(u2.followed_count, 1)
+
+        # drifted counters are recomputed
+        u1.posts_count = 7
+        u2.followers_count = 3
+        db.session.commit()
+        reconcile_counters()
+        db.session.commit()
+        self.assertEqual(
+            (u1.posts_count, u1.followers_count, u1.followed_count),
+            (2, 1, 0)
+        )
+        self.assertEqual(
+            (u2.posts_count, u2.followers_count, u2.followed_count),
+            (0, 0, 1)
+        )
+
+    # noinspection PyArgumentList
+    def test_keyset_pagination(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+
+        # two posts share a timestamp so the id breaks the tie
+        now = datetime.utcnow()
+        posts = [
+            Post(body="post {}".format(i), author=u2,
+                 timestamp=now + timedelta(seconds=min(i, 3)))
+            for i in range(5)
+        ]
+        db.session.add_all(posts)
+        db.session.commit()
+        u1.follow(u2)
+        db.session.commit()
+        newest_first = posts[::-1]
+
+        for query in (Post.query, u2.posts, u1.followed_posts()):
+            p1 = keyset_paginate(query, 2)
+            self.assertEqual(p1.items, newest_first[:2])
+            self.assertTrue(p1.has_next)
+            self.assertFalse(p1.has_prev)
+
+            p2 = keyset_paginate(query, 2, after=p1.next_cursor)
+            self.assertEqual(p2.items, newest_first[2:4])
+            self.assertTrue(p2.has_prev)
+
+            p3 = keyset_paginate(query, 2, after=p2.next_cursor)
+            self.assertEqual(p3.items, newest_first[4:])
+            self.assertFalse(p3.has_next)
+
+            back = keyset_paginate(query, 2, before=p3.prev_cursor)
+            self.assertEqual(back.items, p2.items)
+            back = keyset_paginate(query, 2, before=back.prev_cursor)
+            self.assertEqual(back.items, p1.items)
+            self.assertFalse(back.has_prev)
+
+        # malformed cursors fall back to the first page
+        self.assertEqual(
+            keyset_paginate(Post.query, 2, after='garbage').items,
+            newest_first[:2]
+        )
+
+    # noinspection PyArgumentList
+    def test_last_seen_buffer(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        seen = u1.last_seen + timedelta(hours=1)
+        buffer = LastSeenBuffer()
+
+        # recent values are not rewritten
+        buffer.touch(u1, u1.last_seen + timedelta(seconds=1))
+        self.assertEqual(len(buffer), 0)
+
+        # updates are coalesced until the size threshold
+        self.app.config['LAST_SEEN_FLUSH_SIZE'] = 2
+        buffer.touch(u1, seen - timedelta(minutes=5))
+        buffer.touch(u1, seen)
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(buffer.get(u1.id), seen)
+
+        buffer.touch(u2, seen)
+        self.assertEqual(len(buffer), 0)
+        db.session.expire_all()
+        self.assertEqual(u1.last_seen, seen)
+        self.assertEqual(u2.last_seen, seen)
+
+        # the timer writes the updates of an idle process
+        self.app.config['LAST_SEEN_FLUSH_INTERVAL'] = 0.5
+        buffer.init_app(self.app)
+        buffer.touch(u1, seen + timedelta(hours=1))
+        timer = buffer._timer
+        self.assertEqual(len(buffer), 1)
+        timer.join(5)
+        self.assertEqual(len(buffer), 0)
+        db.session.expire_all()
+        self.assertEqual(u1.last_seen, seen + timedelta(hours=1))
+
+    def test_decayed_top_k(self):
+        self.assertEqual(extract_hashtags('#One #one a#two ##three #four!'),
+                         {'one', 'four'})
+
+        hour = 3600
+        now = 1000 * hour * PERIOD + 10
+        decayed = DecayedTopK(half_life=hour, k=2, capacity=4)
+        decayed.roll(now)
+        for _ in range(3):
+            decayed.add('old', decayed.weight(now - 3 * hour))
+        decayed.add('new', decayed.weight(now))
+        decayed.add('other', decayed.weight(now - hour))
+
+        # 1 use now beats 3 uses 3 half-lives ago
+        top = decayed.top(now)
+        self.assertEqual([tag for tag, _ in top], ['new', 'other'])
+        self.assertAlmostEqual(top[0][1], 1)
+        self.assertAlmostEqual(top[1][1], 0.5)
+        self.assertAlmostEqual(decayed.top(now + 2 * hour)[0][1], 0.25)
+
+        for i in range(3):
+            decayed.add('tag{}'.format(i), decayed.weight(now - 10 * hour))
+        self.assertLessEqual(len(decayed.scores), 4)
+        self.assertEqual([tag for tag, _ in decayed.top(now)],
+                         ['new', 'other'])
+
+        # the landmark moves without changing the counts
+        later = now + PERIOD * hour
+        decayed.roll(later)
+        self.assertAlmostEqual(
+            decayed.top(later)[0][1] / 2.0 ** -PERIOD, 1
+        )
+        decayed.add('fresh', decayed.weight(later))
+        self.assertEqual(decayed.top(later)[0], ('fresh', 1.0))
+
+
+class FeedQueriesCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        follow_graph.clear()
+        post_fragments.clear()
+        availability.clear()
+        db.create_all()
+        trending.flush()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    # noinspection PyArgumentList
+    def seed(self, authors):
+        """
+        one reader following every author, 30 posts spread among them
+        """
+        reader = User(username='reader', email='reader@example.com')
+        users = [
+            User(username='user{}'.format(i),
+                 email='user{}@example.com'.format(i))
+            for i in range(authors)
+        ]
+        db.session.add(reader)
+        db.session.add_all(users)
+        db.session.add_all([
+            Post(body='post {}'.format(i), author=users[i % authors])
+            for i in range(30)
+        ])
+        db.session.commit()
+        for usr in users:
+            reader.follow(usr)
+        db.session.commit()
+        user_cache.clear()
+
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(reader.id)
+            session['_fresh'] = True
+
+        return users
+
+    def count_queries(self, url):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        db.session.remove()
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = self.client.get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertEqual(response.status_code, 200)
+        return len(statements)
+
+    def test_feed_query_count(self):
+        self.seed(authors=1)
+        few = [
+            self.count_queries(url)
+            for url in ('/index', '/explore', '/user/user0')
+        ]
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+        self.seed(authors=25)
+        many = [
+            self.count_queries(url)
+            for url in ('/index', '/explore', '/user/user0')
+        ]
+
+        self.assertEqual(few, many)
+
+    def test_conditional_get(self):
+        self.seed(authors=2)
+        etags = {}
+
+        for url in ('/index', '/explore', '/user/user0'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = etags[url] = response.get_etag()[0]
+
+            statements = []
+
+            def record(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                response = self.client.get(
+                    url,
+                    headers={'If-None-Match': '"{}"'.format(etag)}
+                )
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+            self.assertEqual(response.status_code, 304)
+            self.assertFalse(any('FROM post' in s and 'max' not in s
+                                 for s in statements))
+
+        # a new post changes the validators
+        usr = User.query.filter_by(username='user0').first()
+        usr.publish('a new post')
+        db.session.commit()
+        for url, etag in etags.items():
+            response = self.client.get(
+                url,
+                headers={'If-None-Match': '"{}"'.format(etag)}
+            )
+            self.assertEqual(response.status_code, 200)
+
+    def test_metrics(self):
+        self.seed(authors=1)
+        self.client.get('/explore')
+        metrics = self.client.get('/metrics').get_data(as_text=True)
+
+        self.assertIn('microblog_request_queries_bucket'
+                      '{endpoint="main.explore",le="+Inf"}', metrics)
+        self.assertIn('microblog_cache_hits{cache="user_loader"}', metrics)
+
+        # slow requests are logged with their slowest statement
+        self.app.config['SLOW_REQUEST_THRESHOLD'] = 0
+        with self.assertLogs(self.app.logger, 'WARNING') as logs:
+            self.client.get('/explore')
+        self.assertIn('slow request GET /explore', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_profiler(self):
+        self.seed(authors=1)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.app.config['PROFILER_DIR'] = directory
+        self.app.config['PROFILER_RETENTION'] = 2
+        explore = os.path.join(directory, 'main.explore')
+
+        # not sampled, forged trigger
+        self.client.get('/explore', headers={'X-Profile': 'forged'})
+        self.assertEqual(dump_files(explore), [])
+
+        token = self.app.wsgi_app.trigger_token()
+        for _ in range(3):
+            self.client.get('/explore', headers={'X-Profile': token})
+        self.assertEqual(len(dump_files(explore)), 2)
+
+        self.app.config['PROFILER_SAMPLE_RATE'] = 1
+        self.client.get('/user/user0')
+        user = os.path.join(directory, 'main.user')
+        self.assertEqual(len(dump_files(user)), 1)
+
+        report = hot_functions(explore, top=5)
+        self.assertIn('2 profiled requests', report)
+        self.assertIn('explore', report)
+
+    def test_user_loader_cache(self):
+        self.seed(authors=1)
+        self.count_queries('/explore')
+        self.assertEqual(user_cache.misses, 1)
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.client.get('/explore')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        # only the authors of the page are selected
+        self.assertFalse(any('user.id = ?' in s for s in statements))
+        self.assertEqual(user_cache.hits, 1)
+
+        # a profile edit evicts the cached record
+        response = self.client.post('/edit_profile', data={
+            'username': 'renamed',
+            'about_me': 'hello'
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn(1, user_cache)
+        self.assertTrue(b'Hi, renamed!' in self.client.get('/index').data)
+
+    def test_ttl_cache(self):
+        cache = TTLCache(max_weight=10, ttl=60)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.pop('a'), 1)
+
+        cache.ttl = 0
+        cache.set('b', 2)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_post_fragment_cache(self):
+        self.seed(authors=2)
+        first = self.client.get('/explore').data
+        self.assertEqual(post_fragments.hits, 0)
+
+        second = self.client.get('/explore').data
+        self.assertEqual(first, second)
+        self.assertEqual(post_fragments.hits, len(post_fragments))
+
+        # renaming an author renders their posts again
+        User.query.filter_by(username='user0').first().username = 'renamed'
+        db.session.commit()
+        self.assertTrue(b'/user/renamed' in self.client.get('/explore').data)
+
+    def test_search(self):
+        users = self.seed(authors=2)
+        users[0].publish('Crème brûlée recipe')
+        users[1].publish('recipe of the day, recipe of a crème brûlée recipe')
+        users[1].publish('NEAR "unbalanced (quotes')
+        db.session.commit()
+
+        # the post repeating the word ranks first, accents are ignored
+        page = search_posts('recipe', per_page=1)
+        self.assertEqual(page.items[0].author, users[1])
+        self.assertTrue(page.has_next)
+        page = search_posts('recipe', per_page=1, after=page.next_cursor)
+        self.assertEqual(page.items[0].author, users[0])
+        self.assertFalse(page.has_next)
+        self.assertEqual(len(search_posts('creme BRULEE', 10).items), 2)
+        self.assertEqual(len(search_posts('rec*', 10).items), 2)
+        # only the newest candidates are ranked
+        page = search_posts('recipe', 10, candidates=1)
+        self.assertEqual(page.items[0].author, users[1])
+        self.assertEqual(len(page.items), 1)
+
+        # operators are plain words
+        self.assertEqual(len(search_posts('NEAR "(quotes', 10).items), 1)
+        self.assertEqual(search_posts('" * :', 10).items, [])
+        self.assertEqual(
+            len(search_posts('recipe', 10, after='garbage').items), 2
+        )
+
+        response = self.client.get('/search?q=recipe')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Crème brûlée recipe', response.get_data(as_text=True))
+
+        self.app.config['POSTS_PER_PAGE'] = 1
+        response = self.client.get('/api/search?q=recipe')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(len(data['posts']), 1)
+        self.assertEqual(data['posts'][0]['author'], 'user1')
+        response = self.client.get(
+            '/api/search?q=recipe&after=' + data['next']
+        )
+        self.assertEqual(response.get_json()['next'], None)
+
+        # the index follows the edits and deletions
+        post = search_posts('day', 10).items[0]
+        post.body = 'nothing to see'
+        db.session.commit()
+        self.assertEqual(search_posts('day', 10).items, [])
+        self.assertEqual(search_posts('nothing', 10).items, [post])
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual(search_posts('nothing', 10).items, [])
+
+        # a rebuild indexes the rows written without the triggers
+        with db.engine.begin() as connection:
+            drop_triggers(connection)
+            connection.exec_driver_sql(
+                "UPDATE post SET body = 'rebuilt' WHERE body = 'post 0'"
+            )
+            rebuild_index(connection)
+        self.assertEqual(len(search_posts('rebuilt', 10).items), 1)
+
+    def test_trending(self):
+        self.seed(authors=1)
+        for body in ('#Flask and #python', 'more #flask',
+                     '#python is #fun, #flask too'):
+            response = self.client.post('/index', data={'post': body})
+            self.assertEqual(response.status_code, 302)
+
+        self.assertEqual([tag for tag, _ in trending.top()],
+                         ['flask', 'python', 'fun'])
+        self.assertEqual([tag for tag, _ in trending.top('day')],
+                         ['flask', 'python', 'fun'])
+
+        # the counts survive a restart
+        self.assertEqual(trending.flush(), 6)
+        trending.init_app(self.app)
+        top = trending.top()
+        self.assertEqual([tag for tag, _ in top], ['flask', 'python', 'fun'])
+        self.assertAlmostEqual(top[0][1], 3, places=2)
+
+        # flushes add up, as those of several workers
+        trending.record('#fun #fun #fun')
+        trending.record('#fun again')
+        trending.flush()
+        self.assertEqual(trending.top()[0][0], 'fun')
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = self.client.get('/explore')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertIn(b'#flask</a>', response.data)
+        self.assertIn(b'/search?q=fun', response.data)
+        self.assertFalse(any('trending_tag' in s for s in statements))
+
+        # a failed flush doesn't fail the post, its counts wait for the next
+        self.app.config['TRENDING_FLUSH_INTERVAL'] = 0
+        trending_tags.drop(db.engine)
+        with self.assertLogs(self.app.logger, 'ERROR'):
+            response = self.client.post('/index', data={'post': '#late'})
+        self.assertEqual(response.status_code, 302)
+        trending_tags.create(db.engine)
+        self.assertIn('late', [tag for tag, _ in trending.top()])
+        self.assertEqual(db.session.query(trending_tags).filter_by(
+            tag='late'
+        ).count(), len(self.app.config['TRENDING_WINDOWS']))
+
+    def test_events(self):
+        users = self.seed(authors=2)
+        self.assertEqual(self.client.get('/events').status_code, 404)
+        self.assertNotIn(b'EventSource', self.client.get('/index').data)
+
+        self.app.config['EVENTS_ENABLED'] = True
+        self.app.config['EVENTS_KEEPALIVE'] = 0.01
+        published = broker.published
+        self.assertIn(b'EventSource', self.client.get('/index').data)
+
+        # streams that are never read don't stay subscribed, the server
+        # closes the responses
+        for _ in range(3):
+            self.client.head('/events').close()
+        self.client.get('/events').close()
+        self.assertEqual(broker.stats()['subscribers'], 0)
+
+        response = self.client.get('/events')
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = iter(response.response)
+        self.assertEqual(next(chunks), b'retry: 5000\n\n')
+        self.assertEqual(next(chunks), b': keepalive\n\n')
+        self.assertEqual(broker.stats()['subscribers'], 1)
+
+        # the posts of the followed users and of the reader are pushed
+        users[0].publish('hello')
+        db.session.commit()
+        self.client.post('/index', data={'post': 'my own post'})
+        self.assertEqual(broker.published, published + 1)
+        self.assertIn(b'"author": "reader"', next(chunks))
+        broker.publish(users[1].id, {'body': 'followed'})
+        broker.publish(10 ** 6, {'body': 'not followed'})
+        self.assertEqual(
+            next(chunks),
+            b'event: post\ndata: {"body": "followed"}\n\n'
+        )
+        self.assertEqual(next(chunks), b': keepalive\n\n')
+
+        response.close()
+        self.assertEqual(broker.stats()['subscribers'], 0)
+
+        # a full queue drops the oldest events, the client is told
+        self.app.config['EVENTS_QUEUE_SIZE'] = 2
+        response = self.client.get('/events')
+        chunks = iter(response.response)
+        next(chunks)
+        for i in range(4):
+            broker.publish(users[0].id, {'body': str(i)})
+        self.assertEqual(
+            next(chunks),
+            b'event: overflow\ndata: {"dropped": 2}\n\n'
+        )
+        self.assertIn(b'"body": "2"', next(chunks))
+        response.close()
+        self.assertIn(b'microblog_events_dropped 2',
+                      self.client.get('/metrics').data)
+
+        # admission is bounded
+        self.app.config['EVENTS_MAX_SUBSCRIBERS'] = 0
+        self.assertEqual(self.client.get('/events').status_code, 503)
+
+    def test_events_bridge(self):
+        subscriber = Subscriber({1}, size=10)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        bridges = [
+            SocketBridge(directory, lambda topic, event: subscriber.put(event),
+                         name=name)
+            for name in ('first', 'second')
+        ]
+        for bridge in bridges:
+            bridge.start()
+            self.addCleanup(bridge.close)
+
+        # a socket left by an exited process is removed
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        stale.bind(os.path.join(directory, 'stale.sock'))
+        stale.close()
+
+        bridges[0].send(1, {'body': 'relayed'})
+        self.assertEqual(subscriber.get(timeout=5), {'body': 'relayed'})
+        self.assertEqual(subscriber.get(timeout=0.01), None)
+        self.assertEqual(sorted(os.listdir(directory)),
+                         ['first.sock', 'second.sock'])
+
+        # malformed datagrams don't stop the receiver
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(sender.close)
+        with self.assertLogs('app.events', 'ERROR') as logs:
+            for data in (b'not json', b'5', b'[1]', b'\xff'):
+                sender.sendto(data, bridges[1].path)
+            bridges[0].send(1, {'body': 'after'})
+            self.assertEqual(subscriber.get(timeout=5), {'body': 'after'})
+        self.assertEqual(len(logs.output), 4)
+
+    def test_export(self):
+        users = self.seed(authors=3)
+        reader = User.query.filter_by(username='reader').first()
+        users[0].follow(reader)
+        users[0].publish('comma, "quotes"\nand a new line')
+        db.session.commit()
+        posts = Post.query.filter_by(user_id=users[0].id).order_by(Post.id)
+
+        # the exports are read back by the importer
+        ndjson = b''.join(export_rows('posts', users[0].id))
+        records = list(read_ndjson(StringIO(ndjson.decode('utf-8'))))
+        self.assertEqual([r['id'] for r in records], [p.id for p in posts])
+        self.assertEqual(records[-1]['body'], 'comma, "quotes"\nand a new line')
+        self.assertEqual(records[0]['timestamp'],
+                         posts[0].timestamp.isoformat())
+
+        data = b''.join(export_rows('posts', users[0].id, 'csv'))
+        rows = list(read_csv(StringIO(data.decode('utf-8'), newline='')))
+        self.assertEqual(len(rows), posts.count())
+        self.assertEqual(rows[-1]['body'], 'comma, "quotes"\nand a new line')
+
+        followers = [
+            (r['follower_id'], r['username'])
+            for r in read_ndjson(StringIO(b''.join(
+                export_rows('followers', users[0].id)
+            ).decode('utf-8')))
+        ]
+        self.assertEqual(followers, [(reader.id, 'reader')])
+        followed = b''.join(export_rows('followed', reader.id, 'csv'))
+        self.assertEqual(followed.decode('utf-8').splitlines()[0],
+                         'follower_id,followed_id,username')
+        self.assertEqual(len(followed.splitlines()), 4)
+
+        self.assertEqual(
+            gzip.decompress(b''.join(
+                export_rows('posts', users[0].id, compress=True)
+            )),
+            ndjson
+        )
+
+        response = self.client.get('/export/followed?format=csv&gzip=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Disposition'],
+                         'attachment; filename=reader-followed.csv.gz')
+        self.assertEqual(gzip.decompress(response.data), followed)
+        self.assertEqual(self.client.get('/export/users').status_code, 404)
+
+        # the header stays ascii whatever the username
+        reader.username = 'zoë; "x"'
+        db.session.commit()
+        user_cache.clear()
+        response = self.client.get('/export/posts')
+        self.assertEqual(
+            response.headers['Content-Disposition'],
+            'attachment; filename="zoe; \\"x\\"-posts.ndjson"; '
+            "filename*=UTF-8''zo%C3%AB%3B%20%22x%22-posts.ndjson"
+        )
+
+
+class ReplicaCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.primary = os.path.join(directory, 'primary.db')
+        self.replica = os.path.join(directory, 'replica.db')
+
+        class ReplicatedConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + self.primary
+            DATABASE_REPLICA_URLS = ['sqlite:///' + self.replica]
+            WTF_CSRF_ENABLED = False
+
+        self.app = create_app(ReplicatedConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        follow_graph.clear()
+        user_cache.clear()
+        post_fragments.clear()
+        availability.clear()
+        db.create_all()
+        trending.flush()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.get_replicas().dispose()
+        db.engine.dispose()
+        self.app_context.pop()
+
+    def replicate(self):
+        """
+        copies the primary, closing its connections checkpoints the WAL
+        """
+        db.session.remove()
+        db.engine.dispose()
+        shutil.copy(self.primary, self.replica)
+
+    def get(self, url):
+        db.session.remove()
+        return self.client.get(url).get_data(as_text=True)
+
+    # noinspection PyArgumentList
+    def test_read_replica(self):
+        usr = User(username='susan', email='susan@example.com')
+        db.session.add(usr)
+        db.session.commit()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(usr.id)
+            session['_fresh'] = True
+
+        self.replicate()
+        db.session.add(Post(body='lagging', user_id=1))
+        db.session.commit()
+
+        # the replica does not have the post yet
+        self.assertNotIn('lagging', self.get('/explore'))
+        self.assertGreater(db.get_replicas().reads, 0)
+
+        # a user reads their own writes, from the primary
+        self.client.post('/index', data={'post': 'mine'})
+        page = self.get('/explore')
+        self.assertIn('mine', page)
+        self.assertIn('lagging', page)
+
+        self.app.config['DATABASE_READ_YOUR_WRITES'] = 0
+        self.assertNotIn('mine', self.get('/explore'))
+
+        # the replica fails, reads go to the primary
+        db.get_replicas().dispose()
+        os.remove(self.replica)
+        with self.assertLogs(self.app.logger, 'WARNING'):
+            self.assertIn('mine', self.get('/explore'))
+        self.assertEqual(db.get_replicas().failovers, 1)
+        self.assertIn('mine', self.get('/explore'))
+        self.assertEqual(db.get_replicas().failovers, 1)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)